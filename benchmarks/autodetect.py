@@ -0,0 +1,97 @@
+"""
+Measure how long makemigrations takes to detect the changes of one model among many unchanged ones.
+
+The state of the migrations is restored from the state cache with the fingerprints of its models,
+the project models are imported anew, so they are fingerprinted on every run.
+
+Usage::
+
+    python -m benchmarks.autodetect [number_of_models] [number_of_columns]
+"""
+
+import importlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import peewee as pw
+
+from miggy.router import MIGRATE_TEMPLATE, Router, detect_changes
+
+MODEL = """
+class Model{num}(pw.Model):
+{fields}
+
+    class Meta:
+        table_name = "model_{num}"
+"""
+
+
+def make_models(models: int, columns: int, indent: str = "", extra: str = "") -> str:
+    code = []
+    for num in range(models):
+        fields = [f"    column_{i} = pw.CharField(null=True, index=True)" for i in range(columns)]
+        if num == 0 and extra:
+            fields.append(f"    {extra}")
+        code.append(MODEL.format(num=num, fields="\n".join(fields)))
+    return "\n".join(line and indent + line for line in "\n".join(code).splitlines())
+
+
+def main(models: int, columns: int) -> None:
+    directory = tempfile.mkdtemp()
+    migrate_dir = os.path.join(directory, "migrations")
+    os.mkdir(migrate_dir)
+    try:
+        migrate = make_models(models, columns, indent="    ")
+        migrate += "".join(f"\n    migrator.create_model(Model{num})" for num in range(models))
+        with open(os.path.join(migrate_dir, "001_initial.py"), "w") as f:
+            imports = "import peewee as pw"
+            f.write(MIGRATE_TEMPLATE.format(name="001_initial", imports=imports, migrate=migrate, rollback=""))
+        with open(os.path.join(directory, "bench_models.py"), "w") as f:
+            f.write("import peewee as pw\n" + make_models(models, columns, extra="new = pw.IntegerField(null=True)"))
+        sys.path.insert(0, directory)
+
+        database = pw.SqliteDatabase(":memory:")
+        logger = logging.getLogger(__name__)
+        router = Router(database, migrate_dir=migrate_dir, logger=logger, state_cache=True)
+        router.model.create(name="001_initial")
+        sys.dont_write_bytecode = False
+        # the state cache is saved by the previous makemigrations
+        router.migration_state  # noqa: B018
+
+        router = Router(database, migrate_dir=migrate_dir, logger=logger, state_cache=True)
+        start = time.perf_counter()
+        migration_state = router.migration_state
+        restored = time.perf_counter()
+        project_state = router.load_project_state(importlib.import_module("bench_models"))
+        imported = time.perf_counter()
+        # makemigrations detects the changes both ways
+        changes = detect_changes(migration_state, project_state)
+        detect_changes(project_state, migration_state)
+        detected = time.perf_counter()
+        assert len(changes) == 1
+
+        # as if the state cache was disabled, all the models are fingerprinted
+        migration_state.fingerprints.clear()
+        project_state.fingerprints.clear()
+        start_cold = time.perf_counter()
+        detect_changes(migration_state, project_state)
+        detect_changes(project_state, migration_state)
+        cold = time.perf_counter() - start_cold
+
+        print(f"Detected changes of {models} models with {columns} columns")
+        print(f"restore state: {restored - start:.3f}s, import models: {imported - restored:.3f}s")
+        print(f"detect changes: {detected - imported:.3f}s, without the cached fingerprints: {cold:.3f}s")
+    finally:
+        sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
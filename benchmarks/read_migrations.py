@@ -0,0 +1,78 @@
+"""
+Measure how long it takes to read migration files with a cold and a warm bytecode cache.
+
+Usage::
+
+    python -m benchmarks.read_migrations [number_of_migrations]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import peewee as pw
+
+from miggy.router import MIGRATE_TEMPLATE, Router
+
+MIGRATE = """
+    migrator.add_field(
+        model_name='user',
+        name='field_{num}',
+        field=pw.CharField(max_length=64, null=True, index=True),
+    )
+
+    migrator.alter_field(
+        model_name='user',
+        name='name_{num}',
+        field=pw.CharField(max_length=128, constraints=[pw.SQL("DEFAULT 'empty'")]),
+    )
+"""
+ROLLBACK = """
+    migrator.remove_field(model_name='user', name='field_{num}')
+"""
+
+
+def make_migrations(directory: str, number: int) -> list[str]:
+    names = []
+    for num in range(1, number + 1):
+        name = f"{num:03}_auto"
+        with open(os.path.join(directory, name + ".py"), "w") as f:
+            f.write(
+                MIGRATE_TEMPLATE.format(
+                    name=name,
+                    imports="import peewee as pw",
+                    migrate=MIGRATE.format(num=num),
+                    rollback=ROLLBACK.format(num=num),
+                )
+            )
+        names.append(name)
+    return names
+
+
+def read_all(router: Router, names: list[str]) -> float:
+    start = time.perf_counter()
+    for name in names:
+        router.read(name)
+    return time.perf_counter() - start
+
+
+def main(number: int) -> None:
+    # The cache honours PYTHONDONTWRITEBYTECODE like imports do
+    sys.dont_write_bytecode = False
+    directory = tempfile.mkdtemp()
+    try:
+        names = make_migrations(directory, number)
+        router = Router(pw.SqliteDatabase(":memory:"), migrate_dir=directory)
+        cold = read_all(router, names)
+        warm = read_all(router, names)
+        print(f"Read {number} migrations")
+        print(f"cold cache: {cold:.3f}s")
+        print(f"warm cache: {warm:.3f}s ({cold / warm:.1f}x faster)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
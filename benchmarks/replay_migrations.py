@@ -0,0 +1,62 @@
+"""
+Measure how long it takes to restore the models state from applied migrations.
+
+Usage::
+
+    python -m benchmarks.replay_migrations [number_of_migrations]
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import peewee as pw
+
+from benchmarks.read_migrations import make_migrations
+from miggy.router import MIGRATE_TEMPLATE, Router
+
+CREATE_MODEL = """
+    @migrator.create_table
+    class User(pw.Model):
+        id = pw.AutoField()
+{fields}
+
+        class Meta:
+            table_name = "user"
+"""
+
+
+def main(number: int) -> None:
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "000_initial.py"), "w") as f:
+            fields = "\n".join(f"        name_{num} = pw.CharField(max_length=64)" for num in range(1, number + 1))
+            f.write(
+                MIGRATE_TEMPLATE.format(
+                    name="000_initial",
+                    imports="import peewee as pw",
+                    migrate=CREATE_MODEL.format(fields=fields),
+                    rollback="\n    migrator.remove_model('user')\n",
+                )
+            )
+        names = ["000_initial", *make_migrations(directory, number)]
+        router = Router(pw.SqliteDatabase(":memory:"), migrate_dir=directory, logger=logging.getLogger(__name__))
+        router.model.insert_many([{"name": name} for name in names]).execute()
+        for name in names:
+            # read the migrations beforehand to measure the replay only
+            router.read(name)
+
+        start = time.perf_counter()
+        router.migrator  # noqa: B018
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {len(names)} migrations")
+        print(f"total: {elapsed:.3f}s")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
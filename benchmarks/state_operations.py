@@ -0,0 +1,43 @@
+"""
+Measure how long it takes to build migration operations on wide models.
+
+Usage::
+
+    python -m benchmarks.state_operations [number_of_operations] [number_of_columns]
+"""
+
+import sys
+import time
+
+import peewee as pw
+
+from miggy.migrator import Migrator
+
+MODELS = 10
+
+
+def main(operations: int, columns: int) -> None:
+    migrator = Migrator(pw.SqliteDatabase(":memory:"))
+    for num in range(MODELS):
+        fields: dict[str, pw.Field] = {f"column_{i}": pw.CharField(null=True) for i in range(columns)}
+        migrator.create_model(f"Model{num}", fields, {"table_name": f"model_{num}"})
+
+    start = time.perf_counter()
+    for num in range(operations):
+        model_name = f"model{num % MODELS}"
+        if num % 2:
+            migrator.alter_field(model_name, f"column_{num % columns}", pw.CharField(null=True, max_length=num))
+        else:
+            migrator.add_field(model_name, f"new_{num}", pw.IntegerField(null=True))
+    elapsed = time.perf_counter() - start
+    migrator.clean()
+
+    print(f"Built {operations} operations on {MODELS} models with {columns} columns")
+    print(f"total: {elapsed:.3f}s, per operation: {elapsed / operations * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+    )
@@ -3,32 +3,41 @@ The package description.
 
 """
 
-import datetime as dt
 import logging
-from importlib.metadata import version
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
 
-import peewee as pw
+if TYPE_CHECKING:
+    from .history import MigrateHistory
+    from .migrator import Migrator
+    from .router import Router
+    from .utils import Check, Default
 
-# Package information
-# ===================
-
-__version__ = version("miggy")
+__all__ = ["LOGGER", "Check", "Default", "MigrateHistory", "Migrator", "Router", "__version__"]
 
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.StreamHandler())
 LOGGER.setLevel(logging.INFO)
 
-
-class MigrateHistory(pw.Model):
-    """Presents the migrations in database."""
-
-    name = pw.CharField()
-    migrated_at = pw.DateTimeField(default=dt.datetime.utcnow)
-
-    def __unicode__(self):
-        """String representation."""
-        return self.name
-
-
-from .router import Migrator, Router  # noqa
+# The modules are imported on first access, so the commands which don't need them start faster.
+LAZY_ATTRIBUTES = {
+    "Check": "miggy.utils",
+    "Default": "miggy.utils",
+    "MigrateHistory": "miggy.history",
+    "Migrator": "miggy.migrator",
+    "Router": "miggy.router",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name == "__version__":
+        from importlib.metadata import version
+
+        value = version("miggy")
+    elif name in LAZY_ATTRIBUTES:
+        value = getattr(import_module(LAZY_ATTRIBUTES[name]), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -1,11 +1,11 @@
+import hashlib
 from collections.abc import Sequence
-from functools import lru_cache
 from graphlib import TopologicalSorter
 from typing import Any, NamedTuple
 
 import peewee as pw
 
-from miggy.deconstructor import ModelDeconstructor, fields_not_equal
+from miggy.deconstructor import ModelDeconstructor, deconstructor_factory, fields_not_equal
 from miggy.operations import (
     AddCheckConstraint,
     AddField,
@@ -23,7 +23,7 @@ from miggy.operations import (
     RenameTable,
 )
 from miggy.state import State
-from miggy.utils import ModelIndex, extract_check_meta, indexes_state, resolve_field
+from miggy.utils import ModelIndex, extract_check_meta, resolve_field
 
 from .types import ModelCls
 
@@ -51,7 +51,7 @@ class IndexMeta(NamedTuple):
 
 
 class IndexMetaExtractor:
-    def __init__(self, model_cls: ModelCls, index_obj: ModelIndex) -> None:
+    def __init__(self, model_cls: ModelCls, index_obj: pw.ModelIndex) -> None:
         self.model_cls = model_cls
         self.index_obj = index_obj
 
@@ -85,13 +85,41 @@ class IndexMetaExtractor:
         )
 
 
-def extract_index_meta(model_cls: ModelCls) -> list[IndexMeta]:
-    rebuild_indexes(model_cls)
-    indexes = indexes_state(model_cls).values()
-    return [IndexMetaExtractor(model_cls, i).serialize() for i in indexes]
+# The attribute of the model metadata the extracted indexes are kept in.
+INDEX_META_ATTR = "_miggy_index_meta"
 
 
-def rebuild_indexes(model_cls: ModelCls) -> None:
+def extract_index_meta(model_cls: ModelCls) -> frozenset[IndexMeta]:
+    """
+    Return the indexes of the model, added by the migrations or defined in the Meta class.
+    The model is not changed, the result is kept in its metadata until the indexes change.
+    """
+    return _index_meta(model_cls)[1]
+
+
+def extract_index_meta_in_order(model_cls: ModelCls) -> tuple[IndexMeta, ...]:
+    """Return the indexes of the model in the order they are defined, e.g. to create them."""
+    return _index_meta(model_cls)[0]
+
+
+def _index_meta(model_cls: ModelCls) -> tuple[tuple[IndexMeta, ...], frozenset[IndexMeta]]:
+    meta = model_cls._meta
+    # the index operations change the indexes state in place
+    state: dict[str, ModelIndex] = vars(meta).get("indexes_state", {})
+    key = (meta.name, meta.table_name, tuple(meta.indexes), tuple(state.items()))
+    cached = vars(meta).get(INDEX_META_ATTR)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    indexes = {**state, **build_indexes(model_cls)}
+    ordered = tuple(IndexMetaExtractor(model_cls, i).serialize() for i in indexes.values())
+    result = ordered, frozenset(ordered)
+    vars(meta)[INDEX_META_ATTR] = key, result
+    return result
+
+
+def build_indexes(model_cls: ModelCls) -> dict[str, pw.ModelIndex]:
+    """Build the indexes defined in the Meta class of the model by their names."""
+
     def resolve_fields(fields: Sequence[Any]) -> tuple[str | pw.Field, ...]:
         _fields = []
         for field in fields:
@@ -103,23 +131,24 @@ def rebuild_indexes(model_cls: ModelCls) -> None:
                 raise NotImplementedError
         return tuple(_fields)
 
+    indexes: dict[str, pw.ModelIndex] = {}
     for index_obj in model_cls._meta.indexes:
         # Advanced Indexes
         # https://docs.peewee-orm.com/en/latest/peewee/models.html#advanced-index-creation
         if isinstance(index_obj, pw.ModelIndex):
-            indexes_state(model_cls)[index_obj._name] = index_obj  # type: ignore[attr-defined,assignment]
+            indexes[index_obj._name] = index_obj  # type: ignore[attr-defined]
 
         # Multi-column indexes
         # https://docs.peewee-orm.com/en/latest/peewee/models.html#multi-column-indexes
         elif isinstance(index_obj, (list, tuple)):
             fields, unique = index_obj
             model_index = ModelIndex(model_cls, resolve_fields(fields), unique=unique)  # type: ignore[attr-defined,arg-type]
-            indexes_state(model_cls)[model_index._name] = model_index  # type: ignore[attr-defined]
+            indexes[model_index._name] = model_index  # type: ignore[attr-defined]
         else:
             raise NotImplementedError(
                 f"{type(index_obj)} as Index is not suported. Use ModelIndex, list or tuple instead."
             )
-    model_cls._meta.indexes = []
+    return indexes
 
 
 def diff_indexes_from_meta(current: ModelCls, prev: ModelCls) -> tuple[list[AddIndex], list[DropIndex]]:
@@ -128,13 +157,41 @@ def diff_indexes_from_meta(current: ModelCls, prev: ModelCls) -> tuple[list[AddI
     current_indexes = extract_index_meta(current)
     prev_indexes = extract_index_meta(prev)
 
-    for index_meta in set(current_indexes) - set(prev_indexes):
+    for index_meta in current_indexes - prev_indexes:
         create_changes.append(index_meta.as_operation())
-    for index_meta in set(prev_indexes) - set(current_indexes):
+    for index_meta in prev_indexes - current_indexes:
         drop_changes.append(DropIndex(prev._meta.name, index_meta.name))
     return create_changes, drop_changes
 
 
+def model_fingerprint(model: ModelCls) -> str:
+    """
+    Hash the schema of the model as the autodetector compares it.
+    There are no changes between the models with the same fingerprint.
+    """
+    meta = model._meta
+    schema = (
+        meta.table_name,
+        # the fields are not memoized here, keeping thousands of fingerprints alive slows down the garbage collector
+        sorted((name, deconstructor_factory(field).deconstruct()) for name, field in meta.fields.items()),
+        meta.primary_key.field_names if meta.composite_key else None,  # type: ignore[union-attr]
+        # the indexes and the constraints are compared as sets
+        sorted(map(repr, extract_index_meta(model))),
+        sorted(map(repr, extract_check_meta(model))),
+    )
+    return hashlib.sha1(repr(schema).encode()).hexdigest()
+
+
+def state_fingerprint(state: State, name: str) -> str:
+    """Return the fingerprint of the model, it's kept in the state until the model is got from it again."""
+    key = state.normalize_key(name)
+    fingerprint = state.fingerprints.get(key)
+    if fingerprint is None:
+        fingerprint = model_fingerprint(state[key])
+        state.fingerprints[key] = fingerprint
+    return fingerprint
+
+
 def _get_primary_keys(m: ModelCls):
     meta = m._meta
     if meta.composite_key:
@@ -148,50 +205,67 @@ class MigrationAutodetector:
     def __init__(self, from_state: State, to_state: State) -> None:
         self.from_state = from_state
         self.to_state = to_state
+        # The primary keys of the models before and after, memoized for the lifetime of the detector.
+        self._primary_keys: dict[str, tuple[Any, Any]] = {}
 
     def _sort_operations(self, operations: list[MigrateOperation]) -> list[MigrateOperation]:
         """
         Reorder to make things possible. Reordering may be needed so FKs work
         nicely inside the same app.
         """
+        # the operations are indexed by the dependencies they satisfy, so the sort is linear
+        providers: dict[tuple[str, str | None, Dependency.Type], list[MigrateOperation]] = {}
+        for op in operations:
+            for key in self.provided_dependencies(op):
+                providers.setdefault(key, []).append(op)
+
         ts: TopologicalSorter = TopologicalSorter()
         for op in operations:
             ts.add(op)
             for dep in op.deps:
-                ts.add(op, *(x for x in operations if self.check_dependency(x, dep)))
+                ts.add(op, *providers.get(self.dependency_key(dep), ()))
         return list(ts.static_order())
 
+    def dependency_key(self, dependency: Dependency) -> tuple[str, str | None, Dependency.Type]:
+        """Return the key of the operations satisfying the given dependency."""
+        if dependency.type == Dependency.Type.REMOVE_PK:
+            # any field of the model may need the primary key to be removed first
+            return dependency.model_name, None, dependency.type
+        if dependency.type == Dependency.Type.CREATE:
+            return dependency.model_name, dependency.field_name, dependency.type
+        raise ValueError("Can't handle dependency %r" % (dependency,))
+
+    def provided_dependencies(self, operation: MigrateOperation) -> list[tuple[str, str | None, Dependency.Type]]:
+        """Return the keys of the dependencies satisfied by the given operation."""
+        if isinstance(operation, RemovePrimaryKeyConstraint):
+            return [(operation.model_name, None, Dependency.Type.REMOVE_PK)]
+        if isinstance(operation, (RemoveField, AlterField)) and self.is_old_pk(operation.name, operation.model_name):
+            return [(operation.model_name, None, Dependency.Type.REMOVE_PK)]
+        if isinstance(operation, AddField):
+            return [(operation.model_name, operation.name, Dependency.Type.CREATE)]
+        return []
+
     def check_dependency(self, operation: MigrateOperation, dependency: Dependency) -> bool:
         """
         Return True if the given operation depends on the given dependency,
         False otherwise.
         """
-        if dependency.type == Dependency.Type.REMOVE_PK:
-            if isinstance(operation, RemovePrimaryKeyConstraint):
-                return operation.model_name == dependency.model_name
-            return (isinstance(operation, RemoveField) or isinstance(operation, AlterField)) and self.is_old_pk(
-                operation.name, operation.model_name
-            )
+        return self.dependency_key(dependency) in self.provided_dependencies(operation)
 
-        if dependency.type == Dependency.Type.CREATE:
-            return (
-                isinstance(operation, AddField)
-                and operation.model_name == dependency.model_name
-                and operation.name == dependency.field_name
-            )
+    def primary_keys(self, model_name: str) -> tuple[Any, Any]:
+        """Return the primary keys of the model before and after."""
+        keys = self._primary_keys.get(model_name)
+        if keys is None:
+            keys = _get_primary_keys(self.from_state[model_name]), _get_primary_keys(self.to_state[model_name])
+            self._primary_keys[model_name] = keys
+        return keys
 
-        raise ValueError("Can't handle dependency %r" % (dependency,))
-
-    @lru_cache  # noqa: B019
     def is_old_pk(self, field_name: str, model_name: str) -> bool:
-        old_pks = _get_primary_keys(self.from_state[model_name])
-        new_pks = _get_primary_keys(self.to_state[model_name])
+        old_pks, new_pks = self.primary_keys(model_name)
         return old_pks != new_pks and old_pks == field_name
 
-    @lru_cache  # noqa: B019
     def is_new_pk(self, field_name: str, model_name: str) -> bool:
-        old_pks = _get_primary_keys(self.from_state[model_name])
-        new_pks = _get_primary_keys(self.to_state[model_name])
+        old_pks, new_pks = self.primary_keys(model_name)
         return old_pks != new_pks and new_pks == field_name
 
     def generate_added_fields(self, model_name: str) -> list[AddField]:
@@ -331,13 +405,13 @@ class MigrationAutodetector:
         for name in to_state:
             # Add new models
             if name not in from_state:
-                index_meta = extract_index_meta(to_state[name])
+                index_meta = extract_index_meta_in_order(to_state[name])
                 deconstructed = ModelDeconstructor(to_state[name]).deconstruct()
                 changes.append(CreateModel(**deconstructed))
                 for i in index_meta:
                     changes.append(i.as_operation())
-            # Change existing models
-            else:
+            # Change existing models, the models with the same fingerprint are skipped
+            elif state_fingerprint(self.from_state, name) != state_fingerprint(self.to_state, name):
                 changes += self.diff_one(name)
 
         # Remove models
@@ -6,13 +6,14 @@ import re
 import sys
 
 import click
-from playhouse.db_url import connect
 
 VERBOSE = ["WARNING", "INFO", "DEBUG", "NOTSET"]
 CLEAN_RE = re.compile(r"\s+$", re.M)
 
 
 def get_router(directory, database, schema=None, verbose=0):
+    from playhouse.db_url import connect
+
     from miggy import LOGGER
     from miggy.router import Router
     from miggy.utils import exec_in
@@ -21,6 +22,8 @@ def get_router(directory, database, schema=None, verbose=0):
     config = {}
     migrate_table = "migratehistory"
     ignore = None
+    state_cache = False
+    batch_sql = False
     conf_path = os.path.join(directory, "conf.py")
     if os.path.exists(conf_path):
         with open(conf_path) as cfg:
@@ -29,6 +32,8 @@ def get_router(directory, database, schema=None, verbose=0):
             ignore = config.get("IGNORE", ignore)
             schema = config.get("SCHEMA", schema)
             migrate_table = config.get("MIGRATE_TABLE", migrate_table)
+            state_cache = config.get("STATE_CACHE", state_cache)
+            batch_sql = config.get("BATCH_SQL", batch_sql)
             logging_level = config.get("LOGGING_LEVEL", logging_level).upper()
 
     if isinstance(database, str):
@@ -37,7 +42,15 @@ def get_router(directory, database, schema=None, verbose=0):
     LOGGER.setLevel(logging_level)
 
     try:
-        return Router(database, migrate_table=migrate_table, migrate_dir=directory, ignore=ignore, schema=schema)
+        return Router(
+            database,
+            migrate_table=migrate_table,
+            migrate_dir=directory,
+            ignore=ignore,
+            schema=schema,
+            state_cache=state_cache,
+            batch_sql=batch_sql,
+        )
     except RuntimeError as exc:
         LOGGER.error(exc)
         return sys.exit(1)
@@ -75,19 +88,32 @@ def cli():
 @click.option("--database", default=None, help="Database connection")
 @click.option("--directory", default="migrations", help="Directory where migrations are stored")
 @click.option("--schema", default=None, help="Database schema")
+@click.option(
+    "--watch", is_flag=True, default=False, help="Create a migration whenever the models change, until interrupted."
+)
 @click.option("-v", "--verbose", count=True)
-def makemigrations(name=None, database=None, auto=True, auto_source=False, directory=None, schema=None, verbose=None):
+def makemigrations(
+    name=None, database=None, auto=True, auto_source=False, directory=None, schema=None, watch=False, verbose=None
+):
     """Create a migration automatically
 
     Similar to `create` command, but `auto` is True by default, and `name` not required
     """
-    if name is None:
-        name = "auto_{0:%Y%m%d_%H%M}".format(datetime.datetime.now())  # noqa: DTZ005
+
+    def make_name():
+        return name or "auto_{0:%Y%m%d_%H%M}".format(datetime.datetime.now())  # noqa: DTZ005
 
     router = get_router(directory, database, schema, verbose)
     if auto and auto_source:
         auto = auto_source
-    name = router.create(name, auto=auto)
+    if watch:
+        try:
+            for created in router.watch(make_name, auto=auto):
+                click.echo(f"Migration created: {created}")
+        except KeyboardInterrupt:
+            pass
+        return
+    name = router.create(make_name(), auto=auto)
     if name:
         click.echo(f"Migration created: {name}")
 
@@ -98,15 +124,73 @@ def makemigrations(name=None, database=None, auto=True, auto_source=False, direc
 @click.option("--directory", default="migrations", help="Directory where migrations are stored")
 @click.option("--fake", is_flag=True, default=False, help="Run migration as fake.")
 @click.option("--schema", default=None, help="Database schema")
+@click.option(
+    "--schemas-from",
+    default=None,
+    type=click.File(),
+    help="File with a database schema per line to migrate them all instead of a single one",
+)
+@click.option("--jobs", default=4, type=click.IntRange(min=1), help="Number of schemas migrated at the same time")
 @click.option("-v", "--verbose", count=True)
-def migrate(name=None, database=None, directory=None, schema=None, verbose=None, fake=False):
+def migrate(name=None, database=None, directory=None, schema=None, verbose=None, fake=False, schemas_from=None, jobs=4):
     """Migrate database."""
     router = get_router(directory, database, schema, verbose)
+    if schemas_from:
+        return migrate_schemas(router, schemas_from, name=name, fake=fake, jobs=jobs)
     migrations = router.run(name, fake=fake)
     if migrations:
         click.echo("Migrations completed: %s" % ", ".join(migrations))
 
 
+def migrate_schemas(router, schemas_from, name=None, fake=False, jobs=4):
+    from miggy.router import run_many
+
+    schemas = [line.strip() for line in schemas_from if line.strip() and not line.startswith("#")]
+    failed = []
+    for num, result in enumerate(run_many([router.copy(schema=s) for s in schemas], name, fake=fake, jobs=jobs), 1):
+        progress = f"[{num}/{len(schemas)}] {result.target}:"
+        if result.error:
+            failed.append(result.target)
+            click.echo(f"{progress} failed: {result.error}")
+        else:
+            click.echo(f"{progress} {', '.join(result.migrations) or 'nothing to migrate'}")
+
+    click.echo(f"Schemas migrated: {len(schemas) - len(failed)}, failed: {len(failed)}")
+    if failed:
+        click.echo("Failed schemas: %s" % ", ".join(failed))
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("names", nargs=-1)
+@click.option("--database", default=None, help="Database connection")
+@click.option("--directory", default="migrations", help="Directory where migrations are stored")
+@click.option("--schema", default=None, help="Database schema")
+@click.option("--offline", is_flag=True, default=False, help="Don't connect to the database.")
+@click.option("--after", default=None, help="The last applied migration, with --offline.")
+@click.option("-v", "--verbose", count=True)
+def sqlmigrate(names, database=None, directory=None, schema=None, offline=False, after=None, verbose=None):
+    """
+    Show the SQL of the migrations with given names or of the pending ones.
+    With --offline the database is only used for its dialect and the migrations after --after are pending.
+    """
+    router = get_router(directory, database, schema, verbose)
+    applied = None
+    if offline:
+        todo = router.todo
+        if after and after not in todo:
+            raise click.BadParameter(
+                f"unknown migration {after!r}, the migrations are: {', '.join(todo)}", param_hint="--after"
+            )
+        applied = todo[: todo.index(after) + 1] if after else []
+    try:
+        plan = router.plan_sql([*names] or None, applied=applied)
+    except ValueError as exc:
+        raise click.ClickException(str(exc)) from exc
+    for sql in plan:
+        click.echo(sql if sql.startswith("--") else f"{sql};")
+
+
 @cli.command()
 @click.argument("name")
 @click.option(
@@ -154,15 +238,7 @@ def rollback(name, count, database=None, directory=None, schema=None, verbose=No
     with given --count option as integer number
     """
     router = get_router(directory, database, schema, verbose)
-    if not name:
-        if len(router.done) < count:
-            raise RuntimeError("Unable to rollback %s migrations from %s: %s" % (count, len(router.done), router.done))
-        for _ in range(count):
-            router = get_router(directory, database, schema, verbose)
-            name = router.done[-1]
-            router.rollback(name)
-    else:
-        router.rollback(name)
+    router.rollback(name, count=count)
 
 
 @cli.command()
@@ -189,3 +265,17 @@ def merge(database=None, directory=None, schema=None, verbose=None):
     """Merge migrations into one."""
     router = get_router(directory, database, schema, verbose)
     router.merge()
+
+
+@cli.command()
+@click.option("--name", default="checkpoint", help="Checkpoint name")
+@click.option("--database", default=None, help="Database connection")
+@click.option("--directory", default="migrations", help="Directory where migrations are stored")
+@click.option("--schema", default=None, help="Database schema")
+@click.option("-v", "--verbose", count=True)
+def checkpoint(name, database=None, directory=None, schema=None, verbose=None):
+    """Create a checkpoint of the models state without removing migrations."""
+    router = get_router(directory, database, schema, verbose)
+    name = router.checkpoint(name)
+    if name:
+        click.echo(f"Checkpoint created: {name}")
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import hashlib
 from typing import TYPE_CHECKING, Any
 
 import peewee as pw
 from playhouse.postgres_ext import ArrayField
 
 from miggy.ext.fields import CharEnumField, IntEnumField
-from miggy.utils import array_field, extract_check_meta, extract_default_meta, fk_postfix
+from miggy.utils import FINGERPRINT_ATTR, array_field, extract_check_meta, extract_default_meta, fk_postfix
 
 if TYPE_CHECKING:
     from miggy.types import ModelCls
@@ -214,5 +215,53 @@ def deconstructor_factory(f: pw.Field) -> FieldDeconstructor | CharFieldDeconstr
     return FieldDeconstructor(f)
 
 
+def _modifiers(field: pw.Field) -> tuple[Any, ...] | None:
+    modifiers = field.get_modifiers()
+    return None if modifiers is None else tuple(modifiers)
+
+
+class FieldFingerprint:
+    """
+    What the field is compared by: the deconstructed field and the type of the column.
+    The fingerprints are equal if the deconstructed fields are, the digest is a stable hash of them.
+    """
+
+    __slots__ = ("deconstructed", "column_type", "array_type", "_digest")
+
+    def __init__(self, field: pw.Field) -> None:
+        self.deconstructed = deconstructor_factory(field).deconstruct()
+        self.column_type = (field.field_type, _modifiers(field))
+        self.array_type = None
+        if isinstance(field, ArrayField):
+            self.array_type = (field.dimensions, _modifiers(array_field(field)))  # type: ignore[attr-defined]
+        self._digest: str | None = None
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha1(repr(self.deconstructed).encode()).hexdigest()
+        return self._digest
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FieldFingerprint):
+            return NotImplemented
+        return self.deconstructed == other.deconstructed
+
+    def __hash__(self) -> int:
+        # the values of the params may be unhashable
+        return hash((self.deconstructed.path, tuple(sorted(self.deconstructed.params))))
+
+
+def field_fingerprint(field: pw.Field) -> FieldFingerprint:
+    """
+    Return the fingerprint of the field, it's computed once and kept on the field.
+    The state drops it when the field is changed, see miggy.utils.invalidate_fingerprint.
+    """
+    fingerprint = field.__dict__.get(FINGERPRINT_ATTR)
+    if fingerprint is None:
+        fingerprint = field.__dict__[FINGERPRINT_ATTR] = FieldFingerprint(field)
+    return fingerprint
+
+
 def fields_not_equal(f1: pw.Field, f2: pw.Field) -> bool:
-    return deconstructor_factory(f1).deconstruct() != deconstructor_factory(f2).deconstruct()
+    return field_fingerprint(f1) != field_fingerprint(f2)
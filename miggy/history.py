@@ -0,0 +1,14 @@
+import datetime as dt
+
+import peewee as pw
+
+
+class MigrateHistory(pw.Model):
+    """Presents the migrations in database."""
+
+    name = pw.CharField(unique=True)
+    migrated_at = pw.DateTimeField(default=dt.datetime.utcnow)
+
+    def __unicode__(self):
+        """String representation."""
+        return self.name
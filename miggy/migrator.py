@@ -1,11 +1,9 @@
-from typing import TYPE_CHECKING, Any
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, NamedTuple
 
 import peewee as pw
-from playhouse.migrate import (
-    Operation,
-)
+from playhouse.migrate import Operation
 
-from miggy import LOGGER
 from miggy.deconstructor import ModelDeconstructor
 from miggy.operations import (
     AddCheckConstraint,
@@ -13,6 +11,7 @@ from miggy.operations import (
     AddIndex,
     AddPrimaryKeyConstraint,
     AlterField,
+    Backfill,
     ChangeNullable,
     CreateModel,
     DropIndex,
@@ -32,40 +31,95 @@ from miggy.state import State
 from miggy.types import ModelCls
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Iterator
+
+
+class Phase(NamedTuple):
+    """The consecutive database operations which are run in the same way, in or outside a transaction."""
+
+    atomic: bool
+    operations: "list[Operation | Callable]"
 
 
 class Migration:
-    def __init__(self, state: State, schema_migrator: "SchemaMigrator", schema: str | None = None) -> None:
+    def __init__(
+        self,
+        state: State,
+        schema_migrator: "SchemaMigrator",
+        schema: str | None = None,
+        batch_sql: bool = False,
+    ) -> None:
         self.state = state
         self.schema_migrator = schema_migrator
         self.schema = schema
-        self.operations: list[Operation | Callable] = []
+        self.batch_sql = batch_sql
+        # the operations in the order they were added, a non atomic one starts a phase run outside the transaction
+        self.phases: list[Phase] = []
+        self.state_only = False
+
+    @property
+    def operations(self) -> "list[Operation | Callable]":
+        return [o for phase in self.phases for o in phase.operations]
 
     def append(self, op: MigrateOperation) -> None:
+        if self.state_only:
+            # nothing is going to run the database operations, so don't build them
+            op.state_forwards(self.state)
+            if isinstance(op, CreateModel):
+                # the models are bound to the database as create_table does
+                self.schema_migrator.bind_model(self.state[op.name])
+            return
         self.state.create_snapshot()
         op.state_forwards(self.state)
         from_state = self.state.pop_snapshot()
-        self.operations.extend(op.database_forwards(self.schema_migrator, from_state, self.state))
+        self._extend(
+            op.atomic, self._compilable(op, op.database_forwards(self.schema_migrator, from_state, self.state))
+        )
+        self._extend(
+            False, self._compilable(op, op.database_forwards_deferred(self.schema_migrator, from_state, self.state))
+        )
+
+    def _extend(self, atomic: bool, operations: "list[Operation | Callable]") -> None:
+        if not operations:
+            return
+        if not self.phases or self.phases[-1].atomic != atomic:
+            self.phases.append(Phase(atomic, []))
+        self.phases[-1].operations.extend(operations)
+
+    def _compilable(
+        self, op: MigrateOperation, db_operations: "list[Operation] | list[Callable]"
+    ) -> "list[Operation | Callable]":
+        if not self.schema_migrator.offline:
+            return [*db_operations]
+        # python code can't be compiled, it's mentioned in the SQL
+        call = op.get_operation_call()
+        return [
+            pw.SQL(f"-- {call} is not compiled") if callable(o) and not isinstance(o, Operation) else o
+            for o in db_operations
+        ]
+
+    def _with_schema(self, operations: "list[Operation | Callable]") -> "list[Operation | Callable]":
+        if self.schema:
+            return [self.schema_migrator.select_schema(self.schema), *operations]
+        return [*operations]
 
-    def apply(self, change_schema: bool) -> None:
+    def apply_phase(self, change_schema: bool) -> None:
+        phase = self.phases.pop(0)
         if not change_schema:
             return
 
-        if self.schema:
-            _ops = [self.schema_migrator.select_schema(self.schema), *self.operations]
+        _ops = self._with_schema(phase.operations)
+        # a batch is run as a single transaction
+        if phase.atomic and self.batch_sql:
+            self.schema_migrator.run_batch(_ops)
         else:
-            _ops = [*self.operations]
+            self.schema_migrator.run_operations(_ops)
 
-        for op in _ops:
-            if isinstance(op, Operation):
-                LOGGER.info("%s %s", op.method, op.args)
-                op.run()
-            else:
-                op()
+    def compile(self) -> list[str]:
+        return self.schema_migrator.compile_operations(self._with_schema(self.operations))
 
     def clean(self) -> None:
-        self.operations = []
+        self.phases = []
 
 
 class Migrator(object):
@@ -73,17 +127,18 @@ class Migrator(object):
     A class that provides shortcuts for adding migration operations.
     """
 
-    def __init__(self, database, schema=None):
-        """Initialize the migrator."""
+    def __init__(self, database, schema=None, batch_sql=False, state: State | None = None, offline: bool = False):
+        """Initialize the migrator, the **offline** one compiles the operations instead of running them."""
         if isinstance(database, pw.Proxy):
             database = database.obj
 
         self.database = database
-        self.state = State()
+        self.state = state if state is not None else State()
         self.schema_migrator = SchemaMigrator.from_database(self.database)
+        self.schema_migrator.offline = offline
         self.schema = schema
 
-        self.migration = Migration(self.state, self.schema_migrator, schema=schema)
+        self.migration = Migration(self.state, self.schema_migrator, schema=schema, batch_sql=batch_sql)
 
     def add_operation(self, op: MigrateOperation) -> None:
         """
@@ -91,8 +146,53 @@ class Migrator(object):
         """
         self.migration.append(op)
 
-    def run(self, change_schema: bool = True):
-        self.migration.apply(change_schema)
+    @contextmanager
+    def state_only(self, enabled: bool = True) -> "Iterator[None]":
+        """
+        Apply the operations added within the block to the state only, e.g. to replay applied migrations.
+        It skips the state snapshots and the database operations, so the block must not be run with the schema change.
+        """
+        self.migration.state_only = enabled
+        try:
+            yield
+        finally:
+            self.migration.state_only = False
+
+    @property
+    def has_deferred(self) -> bool:
+        """Whether there are operations left to be run after a non atomic one."""
+        return bool(self.migration.phases)
+
+    @property
+    def next_phase_atomic(self) -> bool:
+        """Whether the operations of the next phase can be run in a transaction."""
+        return self.migration.phases[0].atomic
+
+    def run(self, change_schema: bool = True, deferred: bool = True):
+        """
+        Apply the operations in the order they were added. With **deferred=False** only the atomic operations
+        before the first non atomic one are applied, the rest is kept to be applied by :meth:`run_phase`
+        or :meth:`run_deferred`.
+        """
+        if self.has_deferred and self.next_phase_atomic:
+            self.migration.apply_phase(change_schema)
+        if deferred:
+            self.run_deferred(change_schema)
+
+    def compile(self) -> list[str]:
+        """Compile the operations to SQL without running them, the migrator must be offline."""
+        sql = self.migration.compile()
+        self.clean()
+        return sql
+
+    def run_phase(self, change_schema: bool = True) -> None:
+        """Apply the operations of the next phase, they are either atomic or not."""
+        self.migration.apply_phase(change_schema)
+
+    def run_deferred(self, change_schema: bool = True) -> None:
+        """Apply the operations kept by :meth:`run`."""
+        while self.has_deferred:
+            self.run_phase(change_schema)
         self.clean()
 
     def python(self, func: RunPythonF):
@@ -134,10 +234,10 @@ class Migrator(object):
 
     drop_table = remove_model
 
-    def add_field(self, model_name: str, name: str, field: pw.Field) -> None:
+    def add_field(self, model_name: str, name: str, field: pw.Field, online: bool = False) -> None:
         """A shortcut for adding a :class:`AddField` operation."""
 
-        self.add_operation(AddField(model_name, name, field))
+        self.add_operation(AddField(model_name, name, field, online=online))
 
     def add_fields(self, model_name: str, **fields: Any) -> None:
 
@@ -146,10 +246,10 @@ class Migrator(object):
 
     add_columns = add_fields
 
-    def alter_field(self, model_name: str, name: str, field: pw.Field) -> None:
+    def alter_field(self, model_name: str, name: str, field: pw.Field, online: bool = False) -> None:
         """A shortcut for adding a :class:`AlterField` operation."""
 
-        self.add_operation(AlterField(model_name, name, field))
+        self.add_operation(AlterField(model_name, name, field, online=online))
 
     def change_fields(self, model_name: str, **fields: pw.Field) -> None:
         """A shortcut for adding a :class:`ChangeFields` operation."""
@@ -205,8 +305,13 @@ class Migrator(object):
 
         self.add_operation(DropIndex(model_name, name))
 
-    def add_not_null(self, model_name: str, *names: str) -> None:
-        self.add_operation(ChangeNullable(model_name, *names, is_null=False))
+    def add_not_null(self, model_name: str, *names: str, online: bool = False) -> None:
+        """Add not null, with **online** the table isn't locked while it's scanned (PostgreSQL)."""
+        self.add_operation(ChangeNullable(model_name, *names, is_null=False, online=online))
+
+    def backfill(self, model_name: str, name: str, value: Any = None, batch_size: int = 1000, sleep: float = 0) -> None:
+        """A shortcut for adding a :class:`Backfill` operation."""
+        self.add_operation(Backfill(model_name, name, value, batch_size=batch_size, sleep=sleep))
 
     def drop_not_null(self, model_name: str, *names: str) -> None:
         """Drop not null."""
@@ -12,6 +12,7 @@ from miggy.state import State
 from miggy.types import ModelCls
 from miggy.utils import (
     ModelIndex,
+    copy_field,
     fk_postfix,
     get_single_index,
     get_single_index_name,
@@ -26,6 +27,12 @@ if TYPE_CHECKING:
 RunPythonF = Callable[["SchemaMigrator", "State"], None]
 
 
+def add_or_drop_not_null(schema_migrator: "SchemaMigrator", is_null: bool, online: bool) -> Callable[..., Operation]:
+    if is_null:
+        return schema_migrator.drop_not_null
+    return schema_migrator.add_not_null_online if online else schema_migrator.add_not_null
+
+
 class Dependency(namedtuple("Dependency", "model_name field_name type")):
     class Type(Enum):
         REMOVE_PK = auto()
@@ -37,6 +44,9 @@ class MigrateOperation:
     Base class for a migrate operation
     """
 
+    # Non atomic operations can't run in a transaction, the operations before them are committed first.
+    atomic = True
+
     def __new__(cls, *args, **kwargs):
         self = object.__new__(cls)
         self._constructor_args = (args, kwargs)
@@ -85,6 +95,15 @@ class MigrateOperation:
         """
         raise NotImplementedError
 
+    def database_forwards_deferred(
+        self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
+    ) -> list[Operation] | list[Callable]:
+        """
+        Perform the part of the mutation which can't run in a transaction,
+        it's applied outside the migration transaction right after the operations of :meth:`database_forwards`.
+        """
+        return []
+
 
 class RunPython(MigrateOperation):
     """
@@ -161,7 +180,7 @@ class CreateModel(MigrateOperation):
 
     def database_forwards(
         self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
-    ) -> list[Callable]:
+    ) -> list[Callable | list[pw.Context]]:
         model = to_state[self.name]
         return [schema_migrator.create_table(model)]
 
@@ -187,7 +206,8 @@ class RemoveModel(MigrateOperation):
 class AddIndex(MigrateOperation):
     """
     Creates an index in the database table for the model with model_name.
-    The index will be saved in **Model._meta.indexes_state** dict
+    The index will be saved in **Model._meta.indexes_state** dict.
+    A **concurrently** built index is created outside the migration transaction.
     """
 
     def __init__(
@@ -207,6 +227,7 @@ class AddIndex(MigrateOperation):
         self.name = name
         self.safe = safe
         self.concurrently = concurrently
+        self.atomic = not concurrently
         self._index: ModelIndex | None = None
 
     def build_index(self, model: ModelCls) -> ModelIndex:
@@ -229,9 +250,11 @@ class AddIndex(MigrateOperation):
 
     def database_forwards(
         self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
-    ) -> list[Operation]:
+    ) -> list[Operation] | list[Callable]:
         model = to_state[self.model_name]
         model_index = self.build_index(model)
+        if self.concurrently:
+            return [schema_migrator.add_model_index_concurrently(model_index)]
         return [schema_migrator.add_model_index(model_index)]
 
 
@@ -291,12 +314,15 @@ class RenameTable(MigrateOperation):
 class AddField(MigrateOperation):
     """
     Add a field to a model.
+    With **online** a NOT NULL column is made not null without locking the table while it's scanned (PostgreSQL).
+    NOT NULL is then added outside the migration transaction, which would hold the lock until it ends.
     """
 
-    def __init__(self, model_name: str, name: str, field: pw.Field) -> None:
+    def __init__(self, model_name: str, name: str, field: pw.Field, online: bool = False) -> None:
         self.model_name = model_name
         self.name = name
         self.field = field
+        self.online = online
 
     def state_forwards(self, state: State) -> None:
         state.add_field(self.model_name, self.name, self.field)
@@ -306,18 +332,30 @@ class AddField(MigrateOperation):
     ) -> list[Operation]:
         model = to_state[self.model_name]
         field = model._meta.fields[self.name]
-        return [schema_migrator.add_field(field)]
+        return [schema_migrator.add_field(field, not_null=not self.online)]
+
+    def database_forwards_deferred(
+        self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
+    ) -> list[Operation]:
+        model = to_state[self.model_name]
+        field = model._meta.fields[self.name]
+        if not self.online or field.null:
+            return []
+        return [schema_migrator.add_not_null_online(model._meta.table_name, field.column_name)]
 
 
 class AlterField(MigrateOperation):
     """
     Alter a field for a model.
+    With **online** NOT NULL is added without locking the table while it's scanned (PostgreSQL),
+    outside the migration transaction, which would hold the lock until it ends.
     """
 
-    def __init__(self, model_name: str, name: str, field: pw.Field) -> None:
+    def __init__(self, model_name: str, name: str, field: pw.Field, online: bool = False) -> None:
         self.model_name = model_name
         self.name = name
         self.field = field
+        self.online = online
 
     def state_forwards(self, state: State) -> None:
         state.add_field(self.model_name, self.name, self.field)
@@ -392,12 +430,25 @@ class AlterField(MigrateOperation):
         _ops.extend(self.handle_fk_constraint(old_field, field, schema_migrator))
         _ops.append(schema_migrator._resolve_alter_default_constraint(old_field, field))
         _ops.append(schema_migrator._resolve_alter_check_constraints(old_field, field))
-        if old_field.null != field.null:
+        if old_field.null != field.null and not self.is_online_not_null(old_field, field):
             _operation = schema_migrator.drop_not_null if field.null else schema_migrator.add_not_null
             _ops.append(_operation(table_name, field.column_name))
         _ops.extend(self.handle_indexes(old_field, field, schema_migrator))
         return _ops
 
+    def database_forwards_deferred(
+        self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
+    ) -> list[Operation]:
+        old_field = from_state[self.model_name]._meta.fields[self.name]
+        model = to_state[self.model_name]
+        field = model._meta.fields[self.name]
+        if not self.is_online_not_null(old_field, field):
+            return []
+        return [schema_migrator.add_not_null_online(model._meta.table_name, field.column_name)]
+
+    def is_online_not_null(self, old_field: pw.Field, new_field: pw.Field) -> bool:
+        return self.online and old_field.null and not new_field.null
+
 
 class RemoveField(MigrateOperation):
     """
@@ -468,16 +519,20 @@ class RenameField(MigrateOperation):
 
 
 class ChangeNullable(MigrateOperation):
-    def __init__(self, model_name: str, *names: str, is_null: bool) -> None:
+    def __init__(self, model_name: str, *names: str, is_null: bool, online: bool = False) -> None:
         self.model_name = model_name
         self.names = names
         self.is_null = is_null
+        self.online = online
+        self.atomic = not online
 
     def state_forwards(self, state: State) -> None:
         model = state[self.model_name]
         for name in self.names:
-            field = model._meta.fields[name]
+            # fields are never changed in place, they may be shared with a snapshot of the state
+            field = copy_field(model._meta.fields[name])
             field.null = self.is_null
+            state.add_field(self.model_name, name, field)
 
     def database_forwards(
         self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
@@ -486,7 +541,7 @@ class ChangeNullable(MigrateOperation):
         model = to_state[self.model_name]
         for name in self.names:
             field = model._meta.fields[name]
-            _operation = schema_migrator.drop_not_null if self.is_null else schema_migrator.add_not_null
+            _operation = add_or_drop_not_null(schema_migrator, self.is_null, self.online)
             ops.append(_operation(model._meta.table_name, field.column_name))
         return ops
 
@@ -550,3 +605,38 @@ class RemovePrimaryKeyConstraint(MigrateOperation):
     ) -> list[Operation]:
         model = from_state[self.model_name]
         return [schema_migrator.drop_primary_key_constraint(model._meta.table_name)]
+
+
+class Backfill(MigrateOperation):
+    """
+    Fill the NULL values of the column in batches ordered by the primary key.
+    It's executed after the migration transaction, so put it in a separate migration
+    to be able to resume it after an interruption.
+    """
+
+    # every batch is committed on its own
+    atomic = False
+
+    def __init__(
+        self,
+        model_name: str,
+        name: str,
+        value: Any = None,
+        batch_size: int = 1000,
+        sleep: float = 0,
+    ) -> None:
+        self.model_name = model_name
+        self.name = name
+        self.value = value
+        self.batch_size = batch_size
+        self.sleep = sleep
+
+    def state_forwards(self, state: State) -> None:
+        pass
+
+    def database_forwards(
+        self, schema_migrator: "SchemaMigrator", from_state: State, to_state: State
+    ) -> list[Callable]:
+        model = to_state[self.model_name]
+        field = model._meta.fields[self.name]
+        return [schema_migrator.backfill(model, field, self.value, self.batch_size, self.sleep)]
@@ -1,32 +1,73 @@
+from __future__ import annotations
+
+import ast
+import builtins
+import hashlib
+import json
 import os
 import pkgutil
 import re
 import sys
+import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext, suppress
 from functools import cached_property
-from importlib import import_module
+from importlib import import_module, invalidate_caches
+from importlib.machinery import SourceFileLoader
+from importlib.util import cache_from_source, find_spec
 
 import peewee as pw
 
-from miggy import LOGGER, MigrateHistory
-from miggy.auto import NEWLINE, MigrationAutodetector
-from miggy.migrator import Migrator
-from miggy.operations import MigrateOperation
+import miggy
+from miggy import LOGGER
+from miggy.history import MigrateHistory
 from miggy.state import State
 from miggy.utils import exec_in
-from miggy.writer import OperationWriter
+
+# the light commands, e.g. list, don't need the migrator and the autodetector, so they are imported when used
+if typing.TYPE_CHECKING:
+    import types
+
+    from miggy.migrator import Migrator
+    from miggy.operations import MigrateOperation
 
 CLEAN_RE = re.compile(r"\s+$", re.M)
 CURDIR = os.getcwd()
 DEFAULT_MIGRATE_DIR = os.path.join(CURDIR, "migrations")
-UNDEFINED = object()
+# A class based on a class with one of these names, or on another such class, is taken for a model.
+MODEL_BASES = frozenset({"Model"})
+# The version of the models cache format, see scan_models.
+SCAN_CACHE_FORMAT = 2
 VOID = lambda m, d: None  # noqa
 with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), "template.txt")) as t:
     MIGRATE_TEMPLATE = t.read()
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), "state_cache.txt")) as t:
+    STATE_CACHE_TEMPLATE = t.read()
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), "checkpoint.txt")) as t:
+    CHECKPOINT_TEMPLATE = t.read()
+
+# The names the module used to import, they are imported on first access.
+LAZY_ATTRIBUTES = {
+    "Migrator": "miggy.migrator",
+    "MigrateOperation": "miggy.operations",
+    "MigrationAutodetector": "miggy.auto",
+    "NEWLINE": "miggy.auto",
+    "OperationWriter": "miggy.writer",
+}
+
+
+def __getattr__(name: str) -> typing.Any:
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
 
 
 class Migration:
     atomic = True
+    replaces: list[str] = []
 
     @staticmethod
     def migrate(migrator, database, fake=False) -> None:
@@ -36,6 +77,10 @@ class Migration:
     def rollback(migrator, database, fake=False) -> None:
         pass
 
+    @staticmethod
+    def state(migrator, database, fake=False) -> None:
+        pass
+
 
 class Router(object):
     """Abstract base class for router."""
@@ -50,24 +95,65 @@ class Router(object):
         ignore=None,
         schema=None,
         logger=LOGGER,
+        state_cache=False,
+        batch_sql=False,
+        plan=None,
     ):
         self.database = database
+        self.plan: MigrationPlan | None = plan
         self.migrate_table = migrate_table
         self.schema = schema
         self.ignore = ignore or []
         self.logger = logger
+        self.state_cache = state_cache
+        self.batch_sql = batch_sql
         if not isinstance(self.database, (pw.Database, pw.Proxy)):
             raise RuntimeError("Invalid database: %s" % database)
         self.migrate_dir = migrate_dir
+        # the pending migrations already replayed into the migrator by create
+        self._replayed: set[str] = set()
+
+    def copy(self, **kwargs: typing.Any) -> "Router":
+        """Create a router with the same settings except the given ones, e.g. for another schema."""
+        params = {
+            "database": self.database,
+            "migrate_table": self.migrate_table,
+            "migrate_dir": self.migrate_dir,
+            "ignore": self.ignore,
+            "schema": self.schema,
+            "logger": self.logger,
+            "state_cache": self.state_cache,
+            "batch_sql": self.batch_sql,
+            "plan": self.plan,
+        }
+        return type(self)(**{**params, **kwargs})
 
     @cached_property
     def model(self) -> typing.Type[MigrateHistory]:
         """Initialize and cache MigrationHistory model."""
-        MigrateHistory._meta.database = self.database
-        MigrateHistory._meta.table_name = self.migrate_table
-        MigrateHistory._meta.schema = self.schema
-        MigrateHistory.create_table(True)
-        return MigrateHistory
+        # every router has its own model, so the routers of different schemas can be used at the same time
+        meta = {"database": self.database, "table_name": self.migrate_table, "schema": self.schema}
+        model = type(MigrateHistory.__name__, (MigrateHistory,), {"Meta": type("Meta", (), meta)})
+        model._schema.create_table(safe=True)  # type: ignore[attr-defined]
+        self._create_history_index(model)
+        return model
+
+    def _create_history_index(self, model: typing.Type[MigrateHistory]) -> None:
+        if not self.database.safe_create_index:
+            # e.g. MySQL can't create an index if it doesn't exist
+            indexes = {index.name for index in self.database.get_indexes(model._meta.table_name, model._meta.schema)}
+            if all(index._name in indexes for index in model._meta.fields_to_index()):
+                return
+        try:
+            model._schema.create_indexes(safe=True)  # type: ignore[attr-defined]
+        except pw.IntegrityError:
+            self.logger.warning("Migration history has duplicated names, the unique index is not created")
+
+    @cached_property
+    def history(self) -> dict[str, None]:
+        """The applied migrations in order, loaded once and kept up to date as migrations are run."""
+        query = self.model.select(self.model.name).order_by(self.model.id)  # type: ignore[attr-defined]
+        return dict.fromkeys(mm.name for mm in query)
 
     @property
     def todo(self):
@@ -80,35 +166,174 @@ class Router(object):
     @property
     def done(self):
         """Scan migrations in database."""
-        return [mm.name for mm in self.model.select().order_by(self.model.id)]
+        return list(self.history)
 
     @property
     def diff(self):
         """Calculate difference between fs and db."""
-        done = set(self.done)
-        return [name for name in self.todo if name not in done]
+        return [name for name in self.todo if name not in self.history]
 
     @cached_property
     def migrator(self):
         """Create migrator and setup it with fake migrations."""
-        migrator = Migrator(self.database, self.schema)
-        for name in self.done:
+        from miggy.migrator import Migrator
+
+        done = self.done
+        state = self.plan.state(done, self.database) if self.plan is not None else None
+        if state is not None:
+            return Migrator(self.database, self.schema, batch_sql=self.batch_sql, state=state)
+        return self.replay(done)
+
+    def replay(self, done: list[str]) -> Migrator:
+        """Create migrator and setup it with the given applied migrations."""
+        from miggy.migrator import Migrator
+
+        migrator = Migrator(self.database, self.schema, batch_sql=self.batch_sql)
+        if not self.state_cache:
+            for name in self.restore_checkpoint(migrator, done):
+                self.run_one(name, migrator)
+            return migrator
+
+        migrations = [(name, self.hash(name)) for name in done]
+        cached = self.load_state_cache(migrator, migrations)
+        for name in done[cached:] if cached else self.restore_checkpoint(migrator, done):
             self.run_one(name, migrator)
+        if cached != len(done):
+            self.dump_state_cache(migrator.state, migrations)
         return migrator
 
+    def restore_checkpoint(self, migrator: Migrator, done: list[str]) -> list[str]:
+        """
+        Restore the state from the newest applied checkpoint which replaced migrations are applied.
+        Return the applied migrations that still have to be replayed.
+        """
+        applied = set(done)
+        for name in reversed(done):
+            replaces = self.read_replaces(name)
+            if replaces and applied.issuperset(replaces):
+                migration = self.read(name)
+                self.logger.info('Restore state from "%s"', name)
+                with migrator.state_only():
+                    migration.state(migrator, self.database, fake=True)
+                migrator.run(change_schema=False)
+                replayed = {name, *migration.replaces}
+                return [n for n in done if n not in replayed]
+        return done
+
+    def read_replaces(self, name: str) -> list[str]:
+        """Return the migrations replaced by the checkpoint with given name, the migration is not run."""
+        with open(os.path.join(self.migrate_dir, name + ".py")) as f:
+            source = f.read()
+        # the other migrations aren't parsed
+        if "__REPLACES" not in source:
+            return []
+        for node in ast.parse(source).body:
+            if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "__REPLACES" for t in node.targets):
+                return ast.literal_eval(node.value)
+        return []
+
+    @property
+    def state_cache_path(self) -> str:
+        return os.path.join(self.migrate_dir, "__pycache__", "miggy_state.cache")
+
+    def load_state_cache(self, migrator: Migrator, migrations: list[tuple[str, str]]) -> int:
+        """
+        Restore the cached state into the migrator.
+        Return the number of applied migrations the restored state covers.
+        """
+        try:
+            with open(self.state_cache_path) as f:
+                scope: dict[str, typing.Any] = {}
+                exec_in(f.read(), scope)
+        except FileNotFoundError:
+            return 0
+        except Exception:
+            self.logger.warning("State cache is broken and will be rebuilt")
+            return 0
+
+        cached = [tuple(m) for m in scope.get("MIGRATIONS", [])]
+        if scope.get("VERSION") != miggy.__version__ or not cached or cached != migrations[: len(cached)]:
+            self.logger.debug("State cache is stale")
+            return 0
+
+        self.logger.debug("Restore state after %s from cache", cached[-1][0])
+        with migrator.state_only():
+            scope["migrate"](migrator, self.database, fake=True)
+        migrator.run(change_schema=False)
+        migrator.state.fingerprints.update(scope.get("FINGERPRINTS", {}))
+        return len(cached)
+
+    def dump_state_cache(self, state: State, migrations: list[tuple[str, str]]) -> None:
+        """Save the state after the given migrations, the cache is best-effort."""
+        if not migrations or sys.dont_write_bytecode:
+            return
+        try:
+            migrate, imports = self.serialize_state(state)
+        except ValueError as exc:
+            self.logger.debug("State can't be cached: %s", exc)
+            return
+        # the autodetector skips the models which fingerprints are not changed
+        from miggy.auto import state_fingerprint
+
+        content = STATE_CACHE_TEMPLATE.format(
+            imports="\n".join(sorted(imports)),
+            version=miggy.__version__,
+            migrations=migrations,
+            fingerprints={name: state_fingerprint(state, name) for name in state},
+            migrate=migrate,
+        )
+
+        path = self.state_cache_path
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        except OSError as exc:
+            self.logger.debug("State cache can't be saved: %s", exc)
+
+    def serialize_state(self, state: State) -> tuple[str, set[str]]:
+        """
+        Serialize the state as migrator calls.
+        Raise ValueError if the state can't be restored from them exactly.
+        """
+        from miggy.auto import INDENT
+        from miggy.migrator import Migrator
+
+        # e.g. a lambda default can't be serialized
+        migrate, imports = self._serialize_changes(detect_changes(State(), state))
+
+        scope: dict[str, typing.Any] = {}
+        exec_in("\n".join([*imports, "def migrate(migrator, database, fake=False):", INDENT + "pass", migrate]), scope)
+        migrator = Migrator(self.database)
+        with migrator.state_only():
+            scope["migrate"](migrator, self.database, fake=True)
+        migrator.run(change_schema=False)
+        if detect_changes(migrator.state, state):
+            raise ValueError("the state is not restored exactly")
+        return migrate, imports
+
+    def hash(self, name: str) -> str:
+        """Hash the content of the migration."""
+        with open(os.path.join(self.migrate_dir, name + ".py"), "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
     @property
     def migration_state(self) -> State:
         """Create migrator and setup it with fake migrations."""
         return self.migrator.state
 
-    def load_project_state(self, auto) -> State:
+    def project_modules(self, auto) -> list[str | types.ModuleType]:
+        """Return the modules to scan for models, by default the packages of the current directory."""
         # Need to append the CURDIR to the path for import to work.
-        sys.path.append(CURDIR)
-        modules = [auto]
+        if CURDIR not in sys.path:
+            sys.path.append(CURDIR)
         if isinstance(auto, bool):
-            modules = [m for _, m, ispkg in pkgutil.iter_modules([CURDIR]) if ispkg]
+            return [m for _, m, ispkg in pkgutil.iter_modules([CURDIR]) if ispkg]
+        return [auto]
 
-        models = [m for module in modules for m in load_models(module)]
+    def load_project_state(self, auto) -> State:
+        models = load_models(*self.project_modules(auto))
 
         return State({m._meta.name: m for m in models if m._meta.name not in self.ignore})
 
@@ -125,7 +350,9 @@ class Router(object):
                 return self.logger.exception("Can't import models module")
 
             for migration in self.diff:
-                self.run_one(migration, self.migrator)
+                if migration not in self._replayed:
+                    self.run_one(migration, self.migrator)
+                    self._replayed.add(migration)
 
             migrate_changes = detect_changes(self.migration_state, project_state)
             if not migrate_changes:
@@ -138,8 +365,47 @@ class Router(object):
         self.logger.info('Migration has been created as "%s"', name)
         return name
 
+    def watch(self, name: typing.Callable[[], str], auto=True, interval: float = 0.1) -> typing.Iterator[str]:
+        """
+        Create a migration whenever the sources of the models change, yield the names of the created migrations.
+        The migration state and the imported modules are kept between the changes,
+        only the changed modules and the modules defining models are imported again.
+        """
+        mtimes: dict[str, tuple[int, int]] | None = None
+        # the modules changed since they were imported last time
+        stale: set[str] = set()
+        reported = False
+        while True:
+            try:
+                packages = [_module_sources(module) for module in self.project_modules(auto)]
+                sources = {module: path for package, _ in packages for module, path in package.items()}
+                current = {module: _mtime(path) for module, path in sources.items()}
+                if current != mtimes:
+                    # an error is reported once per change
+                    previous, mtimes, reported = mtimes, current, False
+                    if previous is not None:
+                        changed = {m for m in current.keys() | previous.keys() if current.get(m) != previous.get(m)}
+                        self.logger.info("Changed modules: %s", ", ".join(sorted(changed)))
+                        stale |= changed
+                        # the models of the other modules may be based on or refer to the changed models
+                        scanned = {m: e for package in packages for m, e in _scan_sources(*package).items()}
+                        models = set(_find_models(scanned))
+                        _unload_modules(stale | models, sources)
+                        stale = set()
+                    created = self.create(name(), auto=auto)
+                    if created:
+                        yield created
+            except Exception:
+                # e.g. a syntax error, the migration is created once it's fixed
+                if not reported:
+                    self.logger.exception("Can't create migration")
+                    reported = True
+            time.sleep(interval)
+
     def merge(self, name="initial"):
         """Merge migrations into one."""
+        from miggy.migrator import Migrator
+
         migrator = Migrator(self.database)
         migrate_changes = detect_changes(migrator.state, self.migration_state)
         if not migrate_changes:
@@ -155,9 +421,36 @@ class Router(object):
         self.run_one(name, migrator, change_schema=False, change_history=True)
         self.logger.info('Migrations has been merged into "%s"', name)
 
+    def checkpoint(self, name="checkpoint"):
+        """
+        Create a checkpoint of the models state after all migrations.
+        Unlike merging it keeps the migrations and the history intact.
+        """
+        replaces = self.todo
+        if not replaces:
+            return self.logger.warning("No migrations found.")
+
+        for migration in self.diff:
+            self.run_one(migration, self.migrator)
+        try:
+            state, imports = self.serialize_state(self.migration_state)
+        except ValueError as exc:
+            return self.logger.error("Can't create checkpoint: %s", exc)
+
+        name = f"{len(replaces) + 1:03}_{name}"
+        with open(os.path.join(self.migrate_dir, f"{name}.py"), "w") as f:
+            f.write(
+                CHECKPOINT_TEMPLATE.format(
+                    name=f"{name}.py", imports="\n".join(sorted(imports)), replaces=replaces, state=state
+                )
+            )
+        self.logger.info('Checkpoint has been created as "%s"', name)
+        return name
+
     def clear(self):
         """Clear migrations."""
         self.model.delete().execute()
+        self.history.clear()
 
         # Remove migrations from fs
         for name in self.todo:
@@ -165,6 +458,9 @@ class Router(object):
             os.remove(filename)
 
     def _serialize_changes(self, changes: list[MigrateOperation]):
+        from miggy.auto import NEWLINE
+        from miggy.writer import OperationWriter
+
         imports = set()
         serialized_changes = []
         for c in changes:
@@ -203,28 +499,28 @@ class Router(object):
 
     def read(self, name):
         """Read migration from file."""
-        call_params = {}
-        if os.name == "nt" and sys.version_info >= (3, 0):
-            # if system is windows - force utf-8 encoding
-            call_params["encoding"] = "utf-8"
-        with open(os.path.join(self.migrate_dir, name + ".py"), **call_params) as f:
-            code = f.read()
-            scope = {}
-            exec_in(code, scope)
-
-            atomic, migrate, rollback = (
-                scope.get("__ATOMIC", True),
-                scope.get("migrate", VOID),
-                scope.get("rollback", VOID),
-            )
-
-            class _Migration(Migration):
-                pass
-
-            _Migration.atomic = atomic
-            _Migration.migrate = migrate
-            _Migration.rollback = rollback
-            return _Migration
+        path = os.path.join(self.migrate_dir, name + ".py")
+        # The loader keeps compiled migrations in __pycache__ (keyed by mtime and size) like regular modules,
+        # so the migrations are not parsed again on every run.
+        code = SourceFileLoader(name, path).get_code(name)
+        scope = {}
+        exec_in(code, scope)
+
+        atomic, migrate, rollback = (
+            scope.get("__ATOMIC", True),
+            scope.get("migrate", VOID),
+            scope.get("rollback", VOID),
+        )
+
+        class _Migration(Migration):
+            pass
+
+        _Migration.atomic = atomic
+        _Migration.migrate = migrate
+        _Migration.rollback = rollback
+        _Migration.replaces = scope.get("__REPLACES", [])
+        _Migration.state = scope.get("state", VOID)
+        return _Migration
 
     def run_one(
         self,
@@ -239,33 +535,84 @@ class Router(object):
         try:
             migration = self.read(name)
 
+            def update_history():
+                if change_history:
+                    self._write_history(name, downgrade)
+
             def run_migrator():
                 if not downgrade:
                     self.logger.info('Migrate "%s"', name)
-                    migration.migrate(migrator, self.database, fake=fake)
-                    migrator.run(change_schema)
-                    if change_history:
-                        self.model.create(name=name)
+                    with migrator.state_only(fake):
+                        migration.migrate(migrator, self.database, fake=fake)
                 else:
                     self.logger.info("Rolling back %s", name)
-                    migration.rollback(migrator, self.database, fake=fake)
-                    migrator.run(change_schema)
-                    if change_history:
-                        self.model.delete().where(self.model.name == name).execute()
+                    with migrator.state_only(fake):
+                        migration.rollback(migrator, self.database, fake=fake)
+                # the non atomic operations (e.g. concurrent indexes) and the ones after them are run afterwards
+                migrator.run(change_schema, deferred=False)
+                if not migrator.has_deferred:
+                    update_history()
+
+            atomic = migration.atomic and change_schema
+            with self.database.transaction() if atomic else nullcontext():
+                run_migrator()
 
-                self.logger.info("Done %s", name)
+            # the operations keep their order, the atomic ones after a non atomic one get a transaction of their own
+            while migrator.has_deferred:
+                with self.database.transaction() if atomic and migrator.next_phase_atomic else nullcontext():
+                    migrator.run_phase(change_schema)
+                    if not migrator.has_deferred:
+                        update_history()
 
-            if migration.atomic and change_schema:
-                with self.database.transaction():
-                    run_migrator()
-            else:
-                run_migrator()
+            # the history is changed in memory once the transaction is committed
+            if change_history:
+                self._cache_history(name, downgrade)
+
+            self.logger.info("Done %s", name)
 
         except Exception:
             operation = "Migration" if not downgrade else "Rollback"
             self.logger.exception("%s failed: %s", operation, name)
             raise
 
+    def _write_history(self, name: str, downgrade: bool) -> None:
+        if not downgrade:
+            self.model.create(name=name)
+        else:
+            self.model.delete().where(self.model.name == name).execute()
+
+    def _cache_history(self, name: str, downgrade: bool) -> None:
+        if not downgrade:
+            self.history[name] = None
+        else:
+            self.history.pop(name, None)
+
+    def plan_sql(self, names: list[str] | None = None, applied: list[str] | None = None) -> list[str]:
+        """
+        Compile the SQL of the migrations without running it, by default of the pending migrations.
+        The catalog isn't queried: the constraints are named as the applied migrations created them,
+        or by default of the database. Only the history is read, unless the applied migrations are given.
+        """
+        from miggy.migrator import Migrator
+
+        applied = self.done if applied is None else applied
+        if names is None:
+            names = [name for name in self.todo if name not in set(applied)]
+
+        migrator = Migrator(self.database, self.schema, offline=True)
+        for name in applied:
+            # the SQL of the applied migrations isn't needed, but the names of the constraints they create are
+            self._compile_one(name, migrator, fake=True)
+        sql = []
+        for name in names:
+            sql.append(f"-- {name}")
+            sql.extend(self._compile_one(name, migrator))
+        return sql
+
+    def _compile_one(self, name: str, migrator: Migrator, fake: bool = False) -> list[str]:
+        self.read(name).migrate(migrator, self.database, fake=fake)
+        return migrator.compile()
+
     def run(self, name=None, fake=False):
         """Run migrations."""
         self.logger.info("Starting migrations")
@@ -285,48 +632,381 @@ class Router(object):
 
         return done
 
-    def rollback(self, name):
-        name = name.strip()
+    def rollback(self, name: str | None = None, count: int = 1) -> list[str]:
+        """Rollback the last migration with given name or number of last migrations."""
         done = self.done
         if not done:
             raise RuntimeError("No migrations are found.")
-        if name != done[-1]:
-            raise RuntimeError("Only last migration can be canceled.")
+        if name is not None:
+            if name.strip() != done[-1]:
+                raise RuntimeError("Only last migration can be canceled.")
+            count = 1
+        elif len(done) < count:
+            raise RuntimeError("Unable to rollback %s migrations from %s: %s" % (count, len(done), done))
+        return self._rollback(done[len(done) - count :])
+
+    def rollback_to(self, name: str) -> list[str]:
+        """Rollback the migrations applied after the migration with given name."""
+        name = name.strip()
+        if name not in self.history:
+            raise RuntimeError("Migration %s is not applied." % name)
+        done = self.done
+        return self._rollback(done[done.index(name) + 1 :])
 
-        migrator = self.migrator
-        self.run_one(name, migrator, change_schema=True, downgrade=True, change_history=True)
-        self.logger.warning("Downgraded migration: %s", name)
+    def _rollback(self, names: list[str]) -> list[str]:
+        from miggy.migrator import Migrator
+
+        done = self.done
+        # replay once and keep the state after every migration that is rolled back,
+        # so each rollback gets the state it was written against
+        migrator = self.replay(done[: len(done) - len(names)])
+        states = [migrator.state.copy()]
+        for name in names:
+            self.run_one(name, migrator)
+            states.append(migrator.state.copy())
 
+        for name, state in zip(reversed(names), reversed(states[1:]), strict=True):
+            migrator = Migrator(self.database, self.schema, batch_sql=self.batch_sql, state=state)
+            self.run_one(name, migrator, change_schema=True, downgrade=True, change_history=True)
+            self.logger.warning("Downgraded migration: %s", name)
 
-def load_models(module):
-    """Load models from given module."""
-    modules = _import_submodules(module)
-    return {m for module in modules for m in filter(_check_model, (getattr(module, name) for name in dir(module)))}
+        self.migrator = Migrator(self.database, self.schema, batch_sql=self.batch_sql, state=states[0])
+        return list(reversed(names))
 
 
-def _import_submodules(package, passed=UNDEFINED):
-    if passed is UNDEFINED:
-        passed = set()
+class MigrationPlan:
+    """
+    The states after every migration of the directory, built once and shared by any number of routers
+    with the same migrations, e.g. of a schema per tenant::
 
-    if isinstance(package, str):
-        package = import_module(package)
+        plan = MigrationPlan(Router(database))
+        for schema in schemas:
+            Router(database, schema=schema, plan=plan).run()
 
-    modules = []
+    A router which history is not a prefix of the migrations replays it as usual.
+    """
+
+    def __init__(self, router: Router) -> None:
+        from miggy.migrator import Migrator
+
+        self.migrations: list[str] = router.todo
+        migrator = Migrator(router.database)
+        self.states = [migrator.state.copy()]
+        for name in self.migrations:
+            router.run_one(name, migrator)
+            self.states.append(migrator.state.copy())
+
+    def state(self, done: list[str], database: pw.Database | None = None) -> State | None:
+        """Return a copy of the state after the applied migrations, bound to the database if it's given."""
+        if done != self.migrations[: len(done)]:
+            return None
+        return self.states[len(done)].copy(database=database)
 
-    for _loader, name, is_pkg in pkgutil.walk_packages(package.__path__, package.__name__ + "."):
-        if name in passed:
-            continue
-        passed.add(name)
 
-        module = sys.modules.get(name)
-        if module is None:
-            module = import_module(name)
+class RunResult(typing.NamedTuple):
+    router: Router
+    migrations: list[str]
+    error: Exception | None = None
 
-        modules.append(module)
-        if is_pkg:
-            modules += _import_submodules(module, passed=passed)
+    @property
+    def target(self) -> str:
+        return self.router.schema or self.router.database.database
+
+
+def run_many(routers: list[Router], name=None, fake=False, jobs=4) -> typing.Iterator[RunResult]:
+    """
+    Run the migrations of many routers sharing the migrations directory concurrently,
+    e.g. of a schema per tenant. The routers share a :class:`MigrationPlan`, so the state is replayed once.
+    Yield the results as they are finished, a failed router doesn't stop the others.
+    """
+    plan = MigrationPlan(routers[0]) if routers else None
+    ready = []
+    for router in routers:
+        router.plan = router.plan or plan
+        try:
+            # the history and the state are loaded before the routers are run in the threads
+            router.migrator  # noqa: B018
+        except Exception as exc:
+            router.logger.exception("Failed to load history of %s", router.schema or router.database.database)
+            yield RunResult(router, [], exc)
+            continue
+        ready.append(router)
 
-    return modules
+    def run(router: Router) -> RunResult:
+        applied = set(router.history)
+        try:
+            router.run(name, fake=fake)
+            error = None
+        except Exception as exc:
+            error = exc
+        finally:
+            # the connections are per thread
+            router.database.close()
+        return RunResult(router, [n for n in router.history if n not in applied], error)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from (future.result() for future in as_completed([executor.submit(run, r) for r in ready]))
+
+
+def load_models(*modules: str | types.ModuleType) -> set[type[pw.Model]]:
+    """
+    Load models from given modules.
+    The sources are scanned for the classes of models first, only the modules defining them are imported.
+    The bases of the models are looked up in all the given modules.
+    """
+    scanned: dict[str, dict] = {}
+    for module in modules:
+        scanned.update(_scan_sources(*_module_sources(module)))
+    imported = [import_module(name) for name in _find_models(scanned)]
+    return {m for module in imported for m in filter(_check_model, (getattr(module, name) for name in dir(module)))}
+
+
+def scan_models(sources: dict[str, str], cache_path: str | None = None) -> dict[str, list[str]]:
+    """
+    Find the models in the sources of the modules without importing them.
+    Return the names of the models by the modules defining them.
+    The classes are kept in the cache by the modification time of the sources, so only changed sources are parsed.
+    """
+    return _find_models(_scan_sources(sources, cache_path))
+
+
+def _scan_sources(sources: dict[str, str], cache_path: str | None = None) -> dict[str, dict]:
+    cache = _read_scan_cache(cache_path) if cache_path else {}
+    scanned = {}
+    for name, path in sources.items():
+        stat = os.stat(path)
+        key = [path, stat.st_mtime_ns, stat.st_size]
+        entry = cache.get(name)
+        if entry is None or entry["key"] != key:
+            entry = {"key": key, **_scan_classes(path, name)}
+        scanned[name] = entry
+    if cache_path and scanned != cache:
+        _write_scan_cache(cache_path, scanned)
+    return scanned
+
+
+def _find_models(scanned: dict[str, dict]) -> dict[str, list[str]]:
+    """
+    Return the classes of models by the modules of the scanned ones.
+    The bases are matched by name, the models can be based on the models of other modules.
+    The bases imported from the modules which are not scanned are imported to check them.
+    A class which bases can't be resolved is returned too, its module has to be imported to check it.
+    """
+    # the names of the classes, the aliases and the names imported from the scanned modules, with their bases
+    defined: dict[str, list[str]] = {}
+    for entry in scanned.values():
+        for cls, bases in entry["classes"] + entry["aliases"]:
+            defined.setdefault(cls, []).extend(_short_name(base) for base in bases)
+        for local, source, name in entry["imports"]:
+            if source in scanned and name:
+                defined.setdefault(local, []).append(name)
+
+    models, unresolved = _resolve_bases(scanned, defined)
+    found = True
+    while found:
+        found = False
+        for cls, bases in defined.items():
+            if cls not in models and models.intersection(bases):
+                models.add(cls)
+                found = True
+
+    result = {}
+    for name, entry in scanned.items():
+        classes = [cls for cls, bases in entry["classes"] if models.intersection(map(_short_name, bases))]
+        classes += [cls for cls in unresolved.get(name, {}) if cls not in classes]
+        if classes:
+            result[name] = classes
+    return result
+
+
+def _resolve_bases(scanned: dict[str, dict], defined: dict[str, list[str]]) -> tuple[set[str], dict[str, dict]]:
+    """
+    Return the names of the bases of models, including the ones imported from the modules which are not scanned,
+    and the classes which bases can't be resolved by the modules defining them.
+    """
+    models = set(MODEL_BASES)
+    unresolved: dict[str, dict] = {}
+    for module, entry in scanned.items():
+        imports = {local: (source, name) for local, source, name in entry["imports"]}
+        for cls, bases in entry["classes"]:
+            for base in bases:
+                is_model = _resolve_base(base, imports, scanned, defined)
+                if is_model:
+                    models.add(_short_name(base))
+                elif is_model is None:
+                    unresolved.setdefault(module, {})[cls] = None
+                    # the classes based on it may be models too
+                    models.add(cls)
+    return models, unresolved
+
+
+def _resolve_base(
+    base: str, imports: dict[str, tuple[str, str]], scanned: dict[str, dict], defined: dict[str, list[str]]
+) -> bool | None:
+    """
+    Return whether the base is a model imported from a module which is not scanned,
+    False if it's defined in the scanned modules or is not a model, None if it can't be resolved.
+    """
+    short = _short_name(base)
+    if short in MODEL_BASES or short in defined:
+        return False
+    head, _, rest = base.partition(".")
+    if head in imports:
+        source, name = imports[head]
+        if source in scanned:
+            return False
+        path = ".".join(filter(None, [source, name, rest]))
+        obj = _import_object(path)
+        return None if obj is _UNRESOLVED else _check_model(obj)
+    if not rest and hasattr(builtins, base):
+        return False
+    return None
+
+
+# The result of _import_object for an object which can't be imported.
+_UNRESOLVED = object()
+
+
+def _import_object(path: str) -> typing.Any:
+    """Import the object by its dotted path."""
+    parts = path.split(".")
+    for i in range(len(parts), 0, -1):
+        try:
+            obj: typing.Any = import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        except Exception:
+            return _UNRESOLVED
+        for attr in parts[i:]:
+            obj = getattr(obj, attr, _UNRESOLVED)
+        return obj
+    return _UNRESOLVED
+
+
+def _short_name(base: str) -> str:
+    return base.rpartition(".")[2]
+
+
+def _module_sources(module: str | types.ModuleType) -> tuple[dict[str, str], str | None]:
+    """Return the sources of the module and its submodules by their names, and the path of the scan cache."""
+    name = module if isinstance(module, str) else module.__name__
+    spec = find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+    if not spec.submodule_search_locations:
+        return {name: str(spec.origin)}, None
+    sources: dict[str, str] = {}
+    for path in spec.submodule_search_locations:
+        sources.update(_find_sources(path, name))
+    return sources, os.path.join(next(iter(spec.submodule_search_locations)), "__pycache__", "miggy_models.cache")
+
+
+def _mtime(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _unload_modules(names: set[str], sources: dict[str, str]) -> None:
+    """Remove the modules from the imported ones, so they are imported from their sources again."""
+    for name in names:
+        sys.modules.pop(name, None)
+        # the bytecode of a source changed twice within a second may look up to date
+        if name in sources:
+            with suppress(OSError, NotImplementedError):
+                os.remove(cache_from_source(sources[name]))
+    invalidate_caches()
+
+
+def _find_sources(path: str, package: str) -> dict[str, str]:
+    sources = {}
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if entry.is_dir():
+            if entry.name.isidentifier() and os.path.isfile(os.path.join(entry.path, "__init__.py")):
+                sources.update(_find_sources(entry.path, f"{package}.{entry.name}"))
+        elif entry.name == "__init__.py":
+            sources[package] = entry.path
+        elif entry.name.endswith(".py") and entry.name[:-3].isidentifier():
+            sources[f"{package}.{entry.name[:-3]}"] = entry.path
+    return sources
+
+
+def _scan_classes(path: str, module: str) -> dict[str, list]:
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), path)
+
+    # the relative imports are resolved from the package of the module
+    package = module if os.path.basename(path) == "__init__.py" else module.rpartition(".")[0]
+    classes: list[tuple[str, list[str]]] = []
+    aliases: list[tuple[str, list[str]]] = []
+    # the imported names with the modules they are imported from, e.g. "from peewee import Model as BaseModel"
+    imports: list[tuple[str, str, str]] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            classes.append((node.name, [_base_name(base) for base in node.bases]))
+        elif isinstance(node, ast.ImportFrom):
+            source = node.module or ""
+            if node.level:
+                parent = package.rsplit(".", node.level - 1)[0] if node.level > 1 else package
+                source = f"{parent}.{source}" if source else parent
+            imports.extend((alias.asname or alias.name, source, alias.name) for alias in node.names)
+        elif isinstance(node, ast.Import):
+            # "import a.b" binds "a", "import a.b as c" binds "c" to "a.b"
+            imports.extend(
+                (alias.asname, alias.name, "")
+                if alias.asname
+                else (alias.name.split(".")[0], alias.name.split(".")[0], "")
+                for alias in node.names
+            )
+        # e.g. "BaseModel = db.Model"
+        elif isinstance(node, ast.Assign) and isinstance(node.value, (ast.Name, ast.Attribute)):
+            aliases.extend(
+                (target.id, [_base_name(node.value)]) for target in node.targets if isinstance(target, ast.Name)
+            )
+    return {"classes": classes, "aliases": aliases, "imports": imports}
+
+
+def _base_name(node: ast.expr) -> str:
+    """Return the dotted name of the base, e.g. "pw.Model"."""
+    if isinstance(node, ast.Attribute):
+        value = _base_name(node.value)
+        return f"{value}.{node.attr}" if value else node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    # e.g. "Generic[T]"
+    if isinstance(node, ast.Subscript):
+        return _base_name(node.value)
+    return ""
+
+
+def _read_scan_cache(path: str) -> dict[str, dict]:
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        LOGGER.warning("Models cache is broken and will be rebuilt")
+        return {}
+    if cache.get("version") != miggy.__version__ or cache.get("format") != SCAN_CACHE_FORMAT:
+        return {}
+    # the tuples are stored as lists
+    return {
+        name: {field: value if field == "key" else [tuple(v) for v in value] for field, value in entry.items()}
+        for name, entry in cache["modules"].items()
+    }
+
+
+def _write_scan_cache(path: str, scanned: dict[str, dict]) -> None:
+    if sys.dont_write_bytecode:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"version": miggy.__version__, "format": SCAN_CACHE_FORMAT, "modules": scanned}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as exc:
+        LOGGER.debug("Models cache can't be saved: %s", exc)
 
 
 def _check_model(obj, models=None):
@@ -338,4 +1018,6 @@ def detect_changes(
     from_state: State,
     to_state: State,
 ) -> list[MigrateOperation]:
+    from miggy.auto import MigrationAutodetector
+
     return MigrationAutodetector(from_state, to_state).changes()
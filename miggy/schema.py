@@ -1,28 +1,84 @@
+import re
+import time
 from collections.abc import Callable
-from typing import Any
+from typing import Any, NamedTuple
 
 import peewee as pw
-from playhouse.migrate import MySQLDatabase, PostgresqlDatabase, SqliteDatabase, operation
+from playhouse.migrate import MySQLDatabase, Operation, PostgresqlDatabase, SqliteDatabase, operation
 from playhouse.migrate import MySQLMigrator as MqM
 from playhouse.migrate import PostgresqlMigrator as PgM
 from playhouse.migrate import SchemaMigrator as ScM
 from playhouse.migrate import SqliteMigrator as SqM
-from playhouse.postgres_ext import ArrayField
 
+from miggy import LOGGER
+from miggy.deconstructor import field_fingerprint
 from miggy.types import ModelCls
 from miggy.utils import (
     ModelIndex,
-    array_field,
+    _truncate_constraint_name,
     extract_check_meta,
     get_default_constraint_value,
     get_single_index,
     make_single_index,
 )
 
+Statement = tuple[str, list[Any]]
+
+ALTER_TABLE_RE = re.compile(r"ALTER TABLE ((?:([\"`])[^\"`]+\2\.)?([\"`])[^\"`]+\3) (.+)", re.DOTALL)
+QUOTED_NAME_RE = re.compile(r"([\"`])([^\"`]+)\1")
+
+
+def inline_params(database: pw.Database, sql: str, params: list[Any] | tuple[Any, ...]) -> str:
+    """Render the statement with the params inlined, e.g. to review it or run it by hand."""
+    values = tuple(map(pw._query_val_transform, params))  # type: ignore[attr-defined]
+    if database.param == "?":
+        return sql.replace("?", "%s") % values if values else sql
+    # psycopg2 and pymysql format the query even without params, so "%%" means "%"
+    return sql % values
+
+
+def coalesce_alter_table(statements: list[Statement]) -> list[Statement]:
+    """
+    Merge consecutive ALTER TABLE statements of the same table into one, so the table is locked and rewritten once.
+    Renames, validations and the statements which may contain several commands or comments are left as they are.
+    PostgreSQL doesn't execute the actions of a statement in order: drops go first, then type changes, then the
+    added columns and so on. So drops and the actions on a column another action of the statement is already
+    on, e.g. changing the type of an added column, start a new statement.
+    """
+    merged: list[Statement] = []
+    last_table = None
+    # the quoted names, e.g. of the columns, the actions of the last statement are on
+    names: set[str] = set()
+    for sql, params in statements:
+        match = ALTER_TABLE_RE.fullmatch(sql)
+        if not match or match[4].startswith(("RENAME", "VALIDATE")) or any(s in sql for s in (";", "--", "/*")):
+            merged.append((sql, params))
+            last_table = None
+            continue
+        action_names = {name for _, name in QUOTED_NAME_RE.findall(match[4])}
+        if match[1] == last_table and not match[4].startswith("DROP") and not names & action_names:
+            last_sql, last_params = merged[-1]
+            merged[-1] = (f"{last_sql}, {match[4]}", [*last_params, *params])
+            names |= action_names
+        else:
+            merged.append((sql, params))
+            last_table = match[1]
+            names = action_names
+    return merged
+
 
 class SchemaMigrator(ScM):
     """Extended **playhouse.migrate.SchemaMigrator** from **peewee**"""
 
+    # These operations look into the catalog, so the batched statements must be executed before them.
+    introspective_operations: frozenset[str] = frozenset()
+    # Whether several statements can be sent to the database at once.
+    multiple_statements = False
+    # Whether consecutive ALTER TABLE statements of the same table can be merged.
+    merge_alter_table = True
+    # The offline migrator compiles the operations to SQL without a database connection.
+    offline = False
+
     @classmethod
     def from_database(cls, database):
         """Initialize migrator by db."""
@@ -34,6 +90,78 @@ class SchemaMigrator(ScM):
             return MySQLMigrator(database)
         return super(SchemaMigrator, cls).from_database(database)
 
+    def run_operations(self, operations: list[Operation | Callable]) -> None:
+        """Run the operations one by one."""
+        for op in operations:
+            self._before_operation(op)
+            if isinstance(op, Operation):
+                LOGGER.info("%s %s", op.method, op.args)
+                op.run()
+            else:
+                op()
+
+    def run_batch(self, operations: list[Operation | Callable]) -> None:
+        """
+        Compile the operations to SQL and execute them in as few round trips as the database allows.
+        Consecutive alterations of the same table are merged into a single ALTER TABLE.
+        Callables and the operations that look into the catalog split the batch.
+        """
+        statements: list[Statement] = []
+        for op in operations:
+            if isinstance(op, Operation):
+                LOGGER.info("%s %s", op.method, op.args)
+                self._compile_operation(op, statements)
+            else:
+                self._execute_statements(statements)
+                self._before_operation(op)
+                op()
+        self._execute_statements(statements)
+
+    def compile_operations(self, operations: list[Any]) -> list[str]:
+        """Compile the operations to SQL without executing them."""
+        statements: list[Statement] = []
+        for op in operations:
+            if isinstance(op, Operation):
+                self._compile_operation(op, statements)
+            elif callable(op):
+                raise ValueError(f"{op!r} can't be compiled to SQL")
+            else:
+                self._compile_result(op, statements)
+        return [inline_params(self.database, sql, params) for sql, params in statements]
+
+    def _before_operation(self, op: Operation | Callable) -> None:
+        """Called before an operation is run or compiled."""
+
+    def _compile_operation(self, op: Operation, statements: list[Statement]) -> None:
+        # mirrors Operation.run, but collects the statements instead of executing them
+        self._before_operation(op)
+        if op.method in self.introspective_operations and not self.offline:
+            self._execute_statements(statements)
+        kwargs = {**op.kwargs, "with_context": True}
+        self._compile_result(getattr(op.migrator, op.method)(*op.args, **kwargs), statements)
+
+    def _compile_result(self, result: Any, statements: list[Statement]) -> None:
+        if isinstance(result, (pw.Node, pw.Context)):
+            sql, params = self.database.get_sql_context().sql(result).query()
+            statements.append((sql, params))
+        elif isinstance(result, Operation):
+            self._compile_operation(result, statements)
+        elif isinstance(result, (list, tuple)):
+            for item in result:
+                self._compile_result(item, statements)
+
+    def _execute_statements(self, statements: list[Statement]) -> None:
+        if not statements:
+            return
+        merged = coalesce_alter_table(statements) if self.merge_alter_table else list(statements)
+        statements.clear()
+        if self.multiple_statements:
+            # a new line before the semicolon, so a trailing comment of a raw statement can't swallow it
+            sql = "\n;\n".join(sql for sql, _ in merged)
+            merged = [(sql, [param for _, params in merged for param in params])]
+        for sql, params in merged:
+            self.database.execute_sql(sql, params)
+
     @operation
     def drop_primary_key_constraint(self, table: str, column_name: str):
         raise NotImplementedError
@@ -43,13 +171,11 @@ class SchemaMigrator(ScM):
         raise NotImplementedError
 
     def _types_not_equal(self, old_field: pw.Field, new_field: pw.Field) -> bool:
+        old, new = field_fingerprint(old_field), field_fingerprint(new_field)
         # corner case for array field
-        if isinstance(old_field, ArrayField) and isinstance(new_field, ArrayField):
-            if old_field.dimensions != new_field.dimensions:
-                return True
-            if array_field(old_field).get_modifiers() != array_field(new_field).get_modifiers():
-                return True
-        return old_field.field_type != new_field.field_type or old_field.get_modifiers() != new_field.get_modifiers()
+        if old.array_type is not None and new.array_type is not None and old.array_type != new.array_type:
+            return True
+        return old.column_type != new.column_type
 
     @operation
     def _resolve_alter_column_type(self, old_field: pw.Field, new_field: pw.Field):
@@ -113,7 +239,16 @@ class SchemaMigrator(ScM):
         return pw.SQL(sql, params)
 
     @operation
-    def add_field(self, field: pw.Field) -> list:
+    def add_not_null_online(self, table: str, column: str):
+        """
+        Add NOT NULL without locking the table while it's scanned.
+        Only PostgreSQL supports it, other databases add NOT NULL as usual.
+        """
+        return self.add_not_null(table, column)
+
+    @operation
+    def add_field(self, field: pw.Field, not_null: bool = True) -> list:
+        # With not_null=False the column is left nullable, e.g. to add NOT NULL online afterwards.
         # Adding a column is complicated by the fact that if there are rows
         # present and the field is non-null, then we need to first add the
         # column as a nullable field, then set the value, then add a not null
@@ -146,7 +281,8 @@ class SchemaMigrator(ScM):
                     self.apply_default(table, column_name, field),
                 )
 
-            operations.append(self.add_not_null(table, column_name))
+            if not_null:
+                operations.append(self.add_not_null(table, column_name))
 
         if is_foreign_key and self.explicit_create_foreign_key:
             operations.append(
@@ -169,6 +305,9 @@ class SchemaMigrator(ScM):
         ctx = self.make_context()
         return ctx.sql(model_index)
 
+    def add_model_index_concurrently(self, model_index: ModelIndex) -> Operation | Callable:
+        return self.add_model_index(model_index)
+
     @operation
     def rename_index(self, old_name: str, new_name: str):
         """Change index name"""
@@ -189,23 +328,74 @@ class SchemaMigrator(ScM):
         operations.append(self.resolve_single_index_name(old_field, new_field))
         return operations
 
-    def create_table(self, model: ModelCls, safe: bool = False) -> Callable:
+    def bind_model(self, model: ModelCls) -> None:
         """
-        Create table from model class
+        Bind the model class to the database
         """
         model._meta.database = self.database
         model._meta.legacy_table_names = False
+
+    def create_table(self, model: ModelCls, safe: bool = False) -> Callable | list[pw.Context]:
+        """
+        Create table from model class
+        """
+        self.bind_model(model)
+        if self.offline:
+            schema = model._schema  # type: ignore[attr-defined]
+            return [schema._create_table(safe=safe), *schema._create_indexes(safe=safe)]
         return lambda: model.create_table(safe=safe)
 
-    def drop_table(self, model: ModelCls, safe: bool = False) -> Callable:
+    def drop_table(self, model: ModelCls, safe: bool = False) -> Callable | pw.Context:
         """
         Drop model table
         """
         model._meta.database = self.database
+        if self.offline:
+            return model._schema._drop_table(safe=safe)  # type: ignore[attr-defined]
         return lambda: model.drop_table(safe=safe)
 
+    def backfill(self, model: ModelCls, field: pw.Field, value: Any, batch_size: int, sleep: float = 0) -> Callable:
+        """
+        Set the value to the NULL rows of the column in batches ordered by the primary key.
+        Every batch is committed on its own, so the backfill can be resumed after an interruption.
+        It can't be run in a transaction, which would have to be committed.
+        """
+        self.bind_model(model)
+        pk = model._meta.primary_key
+        if isinstance(pk, pw.CompositeKey) or not pk:
+            raise ValueError(f"Backfill of {model._meta.table_name} requires a single column primary key.")
+        if value is None:
+            if field.default is None:
+                raise ValueError(f"Neither value nor default is specified for {field.column_name}.")
+            value = field.default
+
+        def run() -> None:
+            if self.database.in_transaction():
+                raise RuntimeError(f"Backfill of {model._meta.table_name} can't be run in a transaction.")
+            update_value = value() if callable(value) else value
+            last = None
+            while True:
+                query = model.select(pk).where(field.is_null()).order_by(pk).limit(batch_size)
+                if last is not None:
+                    query = query.where(pk > last)
+                ids = [row[0] for row in query.tuples().execute(self.database)]
+                if not ids:
+                    break
+                model.update({field: update_value}).where(pk.in_(ids)).execute(self.database)
+                LOGGER.info("backfill %s.%s: %d rows", model._meta.table_name, field.column_name, len(ids))
+                last = ids[-1]
+                if len(ids) < batch_size:
+                    break
+                time.sleep(sleep)
+
+        return run
+
 
 class MySQLMigrator(SchemaMigrator, MqM):
+    introspective_operations = frozenset(
+        {"add_not_null", "drop_not_null", "rename_column", "drop_column", "drop_foreign_key_constraint"}
+    )
+
     def alter_change_column(self, table, column, field):
         """Support change columns."""
         ctx = self.make_context()
@@ -215,57 +405,260 @@ class MySQLMigrator(SchemaMigrator, MqM):
         return ctx
 
 
+class ConstraintCatalog(NamedTuple):
+    """The names of the constraints of the current schema."""
+
+    foreign_keys: dict[tuple[str, str], str]
+    primary_keys: dict[str, str]
+
+
 class PostgresqlMigrator(SchemaMigrator, PgM):
     """Support the migrations in postgresql."""
 
+    introspective_operations = frozenset({"rename_table", "drop_foreign_key_constraint", "drop_primary_key_constraint"})
+    multiple_statements = True
+    concurrent_index_attempts = 3
+    # These operations can change the constraints of the catalog snapshot or the schema it's taken from.
+    # The constraints added since the snapshot are found by reloading it on a miss.
+    catalog_operations = frozenset(
+        {"select_schema", "set_search_path", "sql", "rename_table", "rename_column", "drop_column", "drop_table"}
+    )
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._catalog: ConstraintCatalog | None = None
+        # The offline migrator keeps the constraints it has compiled instead of the catalog.
+        # The other constraints get the default names, made of the names the tables and the columns had at first.
+        self._table_origins: dict[str, str] = {}
+        self._column_origins: dict[tuple[str, str], str] = {}
+        self._pk_columns: dict[str, list[str]] = {}
+
+    def run_operations(self, operations: list[Operation | Callable]) -> None:
+        try:
+            super().run_operations(operations)
+        finally:
+            self._catalog = None
+
+    def run_batch(self, operations: list[Operation | Callable]) -> None:
+        try:
+            super().run_batch(operations)
+        finally:
+            self._catalog = None
+
+    def _before_operation(self, op: Operation | Callable) -> None:
+        if self.offline:
+            return
+        # the python code can do anything to the schema
+        if not isinstance(op, Operation) or op.method in self.catalog_operations:
+            self._catalog = None
+
+    @property
+    def offline_catalog(self) -> ConstraintCatalog:
+        if self._catalog is None:
+            self._catalog = ConstraintCatalog({}, {})
+        return self._catalog
+
+    def create_table(self, model: ModelCls, safe: bool = False) -> Callable | list[pw.Context]:
+        if self.offline:
+            table = model._meta.table_name
+            for field in model._meta.sorted_fields:
+                if isinstance(field, pw.ForeignKeyField):
+                    name = field.constraint_name or f"{table}_{field.column_name}_fkey"
+                    self.offline_catalog.foreign_keys[table, field.column_name] = name
+            if model._meta.primary_key:
+                self.offline_catalog.primary_keys[table] = f"{table}_pkey"
+                self._pk_columns[table] = [field.column_name for field in model._meta.get_primary_keys()]
+        return super().create_table(model, safe=safe)
+
+    @operation
+    def add_field(self, field: pw.Field, not_null: bool = True) -> list:
+        if self.offline and isinstance(field, pw.ForeignKeyField) and not self.explicit_create_foreign_key:
+            table = field.model._meta.table_name
+            self.offline_catalog.foreign_keys[table, field.column_name] = f"{table}_{field.column_name}_fkey"
+        return super().add_field(field, not_null=not_null, with_context=True)
+
+    @operation
+    def rename_table(self, old_name: str, new_name: str):
+        if not self.offline:
+            return super().rename_table(old_name, new_name, with_context=True)
+        # the constraints keep their names
+        catalog = self.offline_catalog
+        for _, column in [key for key in catalog.foreign_keys if key[0] == old_name]:
+            catalog.foreign_keys[new_name, column] = catalog.foreign_keys.pop((old_name, column))
+        for _, column in [key for key in self._column_origins if key[0] == old_name]:
+            self._column_origins[new_name, column] = self._column_origins.pop((old_name, column))
+        if old_name in catalog.primary_keys:
+            catalog.primary_keys[new_name] = catalog.primary_keys.pop(old_name)
+        self._table_origins[new_name] = self._table_origins.pop(old_name, old_name)
+
+        operations = [ScM.rename_table(self, old_name, new_name, with_context=True)]
+        # the sequence of a serial primary key is renamed if it exists, "id" is assumed for unknown tables
+        pk_columns = self._pk_columns[new_name] = self._pk_columns.pop(old_name, ["id"])
+        if len(pk_columns) == 1:
+            operations.append(
+                self.make_context()
+                .literal("ALTER SEQUENCE IF EXISTS ")
+                .sql(pw.Entity(f"{old_name}_{pk_columns[0]}_seq"))
+                .literal(" RENAME TO ")
+                .sql(pw.Entity(f"{new_name}_{pk_columns[0]}_seq"))
+            )
+        return operations
+
+    @operation
+    def rename_column(self, table: str, old_name: str, new_name: str):
+        if self.offline:
+            foreign_keys = self.offline_catalog.foreign_keys
+            if (table, old_name) in foreign_keys:
+                foreign_keys[table, new_name] = foreign_keys.pop((table, old_name))
+            self._column_origins[table, new_name] = self._column_origins.pop((table, old_name), old_name)
+        return super().rename_column(table, old_name, new_name, with_context=True)
+
+    @operation
+    def add_foreign_key_constraint(
+        self, table, column_name, rel, rel_column, on_delete=None, on_update=None, constraint_name=None
+    ):
+        if self.offline:
+            name = _truncate_constraint_name(constraint_name or f"fk_{table}_{column_name}_refs_{rel}")
+            self.offline_catalog.foreign_keys[table, column_name] = name
+        return super().add_foreign_key_constraint(
+            table, column_name, rel, rel_column, on_delete, on_update, constraint_name, with_context=True
+        )
+
     @operation
     def select_schema(self, schema):
         """Select database schema"""
         return self.set_search_path(schema)
 
-    def get_foreign_key_constraint(self, table: str, column_name: str) -> str:
+    def drop_invalid_index(self, name: str) -> None:
+        """Drop the index if it's left INVALID by a failed concurrent build."""
+        sql = "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)"
+        row = self.database.execute_sql(sql, (f'"{name}"',)).fetchone()
+        if row and row[0]:
+            LOGGER.info("drop invalid index %s", name)
+            self.database.execute_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+    def add_model_index_concurrently(self, model_index: ModelIndex) -> Operation | Callable:
+        """
+        Build the index concurrently, an INVALID index left by a failed build is dropped before the next attempt.
+        A build failed because of a lock timeout or a deadlock is retried.
+        """
+
+        if self.offline:
+            return self.add_model_index(model_index)
+        name = model_index._name  # type: ignore[attr-defined]
+
+        def run() -> None:
+            for attempt in range(1, self.concurrent_index_attempts + 1):
+                self.drop_invalid_index(name)
+                try:
+                    self.add_model_index(model_index).run()
+                    return
+                except pw.OperationalError:
+                    if attempt == self.concurrent_index_attempts:
+                        self.drop_invalid_index(name)
+                        raise
+                    LOGGER.warning("build of index %s failed, attempt %d", name, attempt)
+                except pw.DatabaseError:
+                    self.drop_invalid_index(name)
+                    raise
+
+        return run
+
+    def load_catalog(self) -> ConstraintCatalog:
+        """Load the foreign and primary key constraints of the current schema in a single query."""
         sql = """
-            SELECT DISTINCT
-                kcu.constraint_name
-            FROM information_schema.table_constraints AS tc
-            JOIN information_schema.key_column_usage AS kcu
-                ON (tc.constraint_name = kcu.constraint_name AND
-                    tc.constraint_schema = kcu.constraint_schema AND
-                    tc.table_name = kcu.table_name AND
-                    tc.table_schema = kcu.table_schema)
-            JOIN information_schema.constraint_column_usage AS ccu
-                ON (ccu.constraint_name = tc.constraint_name AND
-                    ccu.constraint_schema = tc.constraint_schema)
-            WHERE
-                tc.constraint_type = 'FOREIGN KEY' AND
-                tc.table_name = %s AND
-                tc.table_schema = current_schema() AND
-                kcu.column_name  = %s"""
-        cursor = self.database.execute_sql(sql, (table, column_name))
-        return cursor.fetchall()[0][0]
+            SELECT con.contype, tbl.relname, att.attname, con.conname
+            FROM pg_constraint AS con
+            JOIN pg_class AS tbl ON tbl.oid = con.conrelid
+            JOIN pg_namespace AS ns ON ns.oid = tbl.relnamespace
+            JOIN pg_attribute AS att ON att.attrelid = con.conrelid AND att.attnum = ANY(con.conkey)
+            WHERE con.contype IN ('f', 'p') AND ns.nspname = current_schema()"""
+        catalog = ConstraintCatalog({}, {})
+        for contype, table, column, name in self.database.execute_sql(sql).fetchall():
+            if contype == "f":
+                catalog.foreign_keys[table, column] = name
+            else:
+                catalog.primary_keys[table] = name
+        return catalog
+
+    def _lookup_catalog(self, get: Callable[[ConstraintCatalog], str | None], description: str) -> str:
+        name = get(self._catalog) if self._catalog is not None else None
+        if name is None:
+            self._catalog = self.load_catalog()
+            name = get(self._catalog)
+        if name is None:
+            raise ValueError(f"{description} is not found")
+        return name
+
+    def get_foreign_key_constraint(self, table: str, column_name: str) -> str:
+        if self.offline:
+            origin = self._table_origins.get(table, table)
+            column_origin = self._column_origins.get((table, column_name), column_name)
+            return self.offline_catalog.foreign_keys.get((table, column_name), f"{origin}_{column_origin}_fkey")
+        return self._lookup_catalog(
+            lambda catalog: catalog.foreign_keys.get((table, column_name)),
+            f"Foreign key constraint of {table}.{column_name}",
+        )
 
     def get_primary_key_constraint(self, table: str) -> str:
-        sql = """
-            SELECT conname
-            FROM pg_constraint
-            WHERE conrelid = %s::regclass
-            AND contype = 'p';
+        if self.offline:
+            return self.offline_catalog.primary_keys.get(table, f"{self._table_origins.get(table, table)}_pkey")
+        return self._lookup_catalog(
+            lambda catalog: catalog.primary_keys.get(table), f"Primary key constraint of {table}"
+        )
+
+    @operation
+    def drop_constraint_if_exists(self, table: str, name: str):
+        return self._alter_table(self.make_context(), table).literal(" DROP CONSTRAINT IF EXISTS ").sql(pw.Entity(name))
+
+    @operation
+    def validate_constraint(self, table: str, name: str):
+        return self._alter_table(self.make_context(), table).literal(" VALIDATE CONSTRAINT ").sql(pw.Entity(name))
+
+    @operation
+    def add_not_null_online(self, table: str, column: str):
         """
-        cursor = self.database.execute_sql(sql, (table,))
-        return cursor.fetchall()[0][0]
+        Add a NOT VALID check constraint, validate it without blocking writes,
+        then SET NOT NULL skips the table scan because of the validated constraint.
+        The constraint left by a failed validation is dropped before the next attempt.
+        """
+        name = _truncate_constraint_name(f"{table}_{column}_not_null")
+        check = pw.NodeList(
+            (
+                pw.SQL("CHECK"),
+                pw.EnclosedNodeList([pw.NodeList((pw.Entity(column), pw.SQL("IS NOT NULL")))]),
+                pw.SQL("NOT VALID"),
+            )
+        )
+        return [
+            self.drop_constraint_if_exists(table, name),
+            self.add_constraint(table, name, check),
+            self.validate_constraint(table, name),
+            self.add_not_null(table, column),
+            self.drop_constraint(table, name),
+        ]
 
     @operation
     def drop_primary_key_constraint(self, table: str):
         pk_constraint = self.get_primary_key_constraint(table)
+        if self._catalog is not None:
+            del self._catalog.primary_keys[table]
         return self.drop_constraint(table, pk_constraint)
 
     @operation
     def drop_foreign_key_constraint(self, table: str, column_name: str):
         fk_constraint = self.get_foreign_key_constraint(table, column_name)
+        if self._catalog is not None:
+            foreign_keys = self._catalog.foreign_keys
+            for key in [key for key, name in foreign_keys.items() if key[0] == table and name == fk_constraint]:
+                del foreign_keys[key]
         return self.drop_constraint(table, fk_constraint)
 
     @operation
     def add_primary_key_constraint(self, table: str, *column_names: str):
+        if self.offline:
+            self.offline_catalog.primary_keys[table] = f"{table}_pkey"
+            self._pk_columns[table] = list(column_names)
         return (
             self._alter_table(self.make_context(), table)
             .literal(" ADD PRIMARY KEY ")
@@ -273,9 +666,163 @@ class PostgresqlMigrator(SchemaMigrator, PgM):
         )
 
 
+class TableRebuild(NamedTuple):
+    table: str
+    updates: list[tuple[str, Callable]]
+
+
 class SqliteMigrator(SchemaMigrator, SqM):
     """Support the migrations in sqlite."""
 
+    # SQLite supports a single action per ALTER TABLE.
+    merge_alter_table = False
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._rebuild: TableRebuild | None = None
+
+    def run_operations(self, operations: list[Operation | Callable]) -> None:
+        """
+        Run the operations one by one.
+        Consecutive alterations of the same table which require to rebuild it are done in a single rebuild.
+        """
+        try:
+            super().run_batch(operations)
+        finally:
+            # the migrator is reused, a failed batch must not leave a rebuild for the next one
+            self._rebuild = None
+
+    def run_batch(self, operations: list[Operation | Callable]) -> None:
+        self.run_operations(operations)
+
+    def _compile_operation(self, op: Operation, statements: list[Statement]) -> None:
+        if op.method != "_update_column":
+            super()._compile_operation(op, statements)
+            return
+        table, column, fn = op.args
+        if self.offline:
+            raise ValueError(f"{table}.{column} can't be compiled to SQL, SQLite rebuilds the table from the database")
+        if self._rebuild is not None and self._rebuild.table == table and not statements:
+            self._rebuild.updates.append((column, fn))
+            return
+        self._execute_statements(statements)
+        self._rebuild = TableRebuild(table, [(column, fn)])
+
+    def _execute_statements(self, statements: list[Statement]) -> None:
+        # a pending rebuild always precedes the statements compiled after it
+        if self._rebuild is not None:
+            rebuild, self._rebuild = self._rebuild, None
+            queries: list[Statement] = []
+            self._compile_result(self._update_columns(rebuild.table, rebuild.updates, with_context=True), queries)
+            super()._execute_statements(queries)
+        super()._execute_statements(statements)
+
+    @operation
+    def _update_columns(self, table: str, updates: list[tuple[str, Callable]]):
+        """
+        The same as **_update_column** of **peewee**, but applies several updates within a single table rebuild.
+        """
+        columns = {column.name.lower() for column in self.database.get_columns(table)}
+        table, create_table = self._get_create_table(table)
+        indexes = self.database.get_indexes(table)
+        create_table = re.sub(r"\s+", " ", create_table)
+        raw_create, raw_columns = self.column_re.search(create_table).groups()
+        column_defs = [col.strip() for col in self.column_split_re.findall(raw_columns)]
+        constraint_terms = ("foreign ", "primary ", "constraint ", "check ", "unique ")
+
+        # original column name -> its current name and definition, None if the column is dropped
+        current: dict[str, tuple[str, str] | None] = {}
+        constraint_defs = []
+        for column_def in column_defs:
+            if column_def.lower().startswith(constraint_terms):
+                constraint_defs.append(column_def)
+            else:
+                (column_name,) = self.column_name_re.match(column_def).groups()
+                current[column_name] = (column_name, column_def)
+
+        self._apply_column_updates(table, columns, current, updates)
+        cleaned_constraints = self._fix_foreign_keys(constraint_defs, current)
+
+        kept = {original: state for original, state in current.items() if state is not None}
+        temp_table = table + "__tmp__"
+        rgx = re.compile(r'("?)%s("?)\s*$' % re.escape(table), re.I)
+        create = rgx.sub(r"\1%s\2" % temp_table, raw_create)
+        definitions = ", ".join([*(column_def for _, column_def in kept.values()), *cleaned_constraints])
+        queries: list[Any] = [
+            pw.NodeList([pw.SQL("DROP TABLE IF EXISTS"), pw.Entity(temp_table)]),
+            pw.SQL("%s (%s)" % (create.strip(), definitions)),
+            pw.NodeList(
+                (
+                    pw.SQL("INSERT INTO"),
+                    pw.Entity(temp_table),
+                    pw.EnclosedNodeList([pw.Entity(name) for name, _ in kept.values()]),
+                    pw.SQL("SELECT"),
+                    pw.CommaNodeList([pw.Entity(original) for original in kept]),
+                    pw.SQL("FROM"),
+                    pw.Entity(table),
+                )
+            ),
+            pw.NodeList([pw.SQL("DROP TABLE"), pw.Entity(table)]),
+            self.rename_table(temp_table, table),
+        ]
+
+        queries.extend(self._fix_indexes(indexes, current))
+        return queries
+
+    def _apply_column_updates(
+        self,
+        table: str,
+        columns: set[str],
+        current: dict[str, tuple[str, str] | None],
+        updates: list[tuple[str, Callable]],
+    ) -> None:
+        for column_to_update, fn in updates:
+            if column_to_update.lower() not in columns:
+                raise ValueError('Column "%s" does not exist on "%s"' % (column_to_update, table))
+            original = next((o for o, c in current.items() if c is not None and c[0] == column_to_update), None)
+            if original is None:
+                continue
+            new_column_def = fn(column_to_update, current[original][1])  # type: ignore[index]
+            columns.discard(column_to_update.lower())
+            if new_column_def:
+                (new_column,) = self.column_name_re.match(new_column_def).groups()
+                current[original] = (new_column, new_column_def)
+                columns.add(new_column.lower())
+            else:
+                current[original] = None
+
+    def _fix_foreign_keys(self, constraint_defs: list[str], current: dict[str, tuple[str, str] | None]) -> list[str]:
+        """Update or remove the foreign keys of renamed or dropped columns."""
+        cleaned = []
+        for constraint_def in constraint_defs:
+            match = self.fk_re.match(constraint_def)
+            if match is not None and match.groups()[0] in current:
+                if (state := current[match.groups()[0]]) is None:
+                    continue
+                if state[0] != match.groups()[0]:
+                    constraint_def = self.fk_re.sub('FOREIGN KEY ("%s") ' % state[0], constraint_def)
+            cleaned.append(constraint_def)
+        return cleaned
+
+    def _fix_indexes(self, indexes: list[Any], current: dict[str, tuple[str, str] | None]) -> list[pw.SQL]:
+        """Re-create user-defined indexes, they have a non-empty SQL attribute."""
+        queries = []
+        for index in filter(lambda idx: idx.sql, indexes):
+            sql = index.sql
+            for original in index.columns:
+                if original not in current:
+                    continue
+                if (state := current[original]) is None:
+                    # the index of a dropped column is dropped too
+                    sql = None
+                elif state[0] != original:
+                    sql = self._fix_index(sql, original, state[0])
+                if sql is None:
+                    break
+            if sql is not None:
+                queries.append(pw.SQL(sql))
+        return queries
+
     def drop_table(self, model, cascade=True):
         """SQLite doesnt support cascade syntax by default."""
         return lambda: model.drop_table(cascade=False)
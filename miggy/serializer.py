@@ -4,7 +4,7 @@ from typing import Any, NamedTuple
 
 import peewee as pw
 
-from miggy.deconstructor import Path, deconstructor_factory
+from miggy.deconstructor import Path, field_fingerprint
 from miggy.utils import CheckMeta, DefaultMeta
 
 FUNCTION_TYPES = (types.FunctionType, types.BuiltinFunctionType, types.MethodType)
@@ -140,8 +140,7 @@ class PathSerializer(BaseSerializer):
 
 class FieldSerializer(BaseSerializer):
     def serialize_to_code(self) -> str:
-        deconstructed_field = deconstructor_factory(self.value).deconstruct()
-        path, params = deconstructed_field
+        path, params = field_fingerprint(self.value).deconstructed
         field = self.serialize_value(path)
         param_str = ", ".join("%s=%s" % (k, self.serialize_value(v)) for k, v in sorted(params.items()))
         return f"{field}({param_str})"
@@ -4,7 +4,17 @@ from typing import Any
 import peewee as pw
 
 from miggy.types import ModelCls
-from miggy.utils import copy_model, costraints, extract_check_meta
+from miggy.utils import (
+    Check,
+    FrozenModel,
+    copy_field,
+    copy_model,
+    costraints,
+    extract_check_meta,
+    freeze_model,
+    invalidate_fingerprint,
+    thaw_model,
+)
 
 ModelDict = dict[str, ModelCls]
 
@@ -24,51 +34,110 @@ class State:
         User.get(id=1)
     """
 
-    def __init__(self, data: ModelDict | None = None) -> None:
+    def __init__(self, data: ModelDict | None = None, frozen: dict[str, FrozenModel] | None = None) -> None:
         self.data: ModelDict = data or {}
+        # models which are rebuilt on the first access, see pop_snapshot
+        self._frozen: dict[str, FrozenModel] = frozen or {}
         self._snapshot: ModelDict | None = None
+        self._snapshot_frozen: dict[str, FrozenModel] = {}
+        # the fingerprints of the models, see miggy.auto.model_fingerprint.
+        # A fingerprint is dropped when the model is got by key, as the caller may change it.
+        self.fingerprints: dict[str, str] = {}
 
     def normalize_key(self, key: str) -> str:
-        _key = key.lower()
-        if self._snapshot is not None:
-            if _key in self._snapshot:
-                self._snapshot[_key] = copy_model(self._snapshot[_key])
-        return _key
+        return key.lower()
 
     def __iter__(self) -> Generator[str, None]:
         for name in self.data:
             yield name
 
     def __setitem__(self, key: str, val: ModelCls) -> None:
-        self.data[self.normalize_key(key)] = val
+        _key = self.normalize_key(key)
+        self._frozen.pop(_key, None)
+        self.fingerprints.pop(_key, None)
+        self.data[_key] = val
 
     def __getitem__(self, key: str) -> ModelCls:
-        return self.data[self.normalize_key(key)]
+        _key = self.normalize_key(key)
+        if _key in self._frozen:
+            self._thaw_model(_key)
+        model = self.data[_key]
+        self.fingerprints.pop(_key, None)
+        # copy-on-write: the caller may mutate the model, so the snapshot keeps the model as it is now.
+        # Freezing is cheap, the model class is only rebuilt if the snapshot is asked for it.
+        if self._snapshot is not None and _key not in self._snapshot_frozen and self._snapshot.get(_key) is model:
+            self._snapshot_frozen[_key] = freeze_model(model)
+        return model
 
     def __delitem__(self, key: str) -> None:
-        del self.data[self.normalize_key(key)]
+        _key = self.normalize_key(key)
+        self._frozen.pop(_key, None)
+        self.fingerprints.pop(_key, None)
+        del self.data[_key]
 
     def __contains__(self, key: str) -> bool:
         return self.normalize_key(key) in self.data
 
     def items(self) -> ItemsView[str, ModelCls]:
+        self._thaw()
         return self.data.items()
 
     def values(self) -> ValuesView[ModelCls]:
+        self._thaw()
         return self.data.values()
 
+    def _thaw(self) -> None:
+        for key in list(self._frozen):
+            if key in self._frozen:
+                self._thaw_model(key)
+
+    def _thaw_model(self, key: str) -> None:
+        # A foreign key sets its backref on the related model, so the foreign keys are bound
+        # to the models of this state instead of the ones the model was frozen with.
+        # The foreign keys to the frozen models are added once the model is set, as the models may refer to each other.
+        frozen = self._frozen.pop(key)
+        fields: dict[str, pw.Field] = {}
+        deferred: dict[str, tuple[pw.Field, str]] = {}
+        for name, field in frozen.fields.items():
+            rel_key = self._relation_key(field)
+            if rel_key is None:
+                fields[name] = field
+            elif rel_key in self._frozen and not field.primary_key:
+                deferred[name] = field, rel_key
+            else:
+                fields[name] = _rebind_relation(field, self._get(rel_key))
+        model = self.data[key] = thaw_model(frozen._replace(fields=fields))
+        for name, (field, rel_key) in deferred.items():
+            model._meta.add_field(name, _rebind_relation(field, self._get(rel_key)))
+
+    def _get(self, key: str) -> ModelCls:
+        if key in self._frozen:
+            self._thaw_model(key)
+        return self.data[key]
+
+    def _relation_key(self, field: pw.Field) -> str | None:
+        if not isinstance(field, pw.ForeignKeyField) or field._is_self_reference:
+            return None
+        key = self.normalize_key(field.rel_model._meta.name)
+        return key if key in self.data else None
+
     def create_snapshot(self) -> None:
+        self._thaw()
         self._snapshot = self.data.copy()
+        self._snapshot_frozen = {}
 
     def pop_snapshot(self) -> "State":
-        _snapshot = self._snapshot
-        self._snapshot = None
-        return State(_snapshot)
+        """Return the state as it was at the time of :meth:`create_snapshot`."""
+        _snapshot, _frozen = self._snapshot, self._snapshot_frozen
+        self._snapshot, self._snapshot_frozen = None, {}
+        return State(_snapshot, _frozen)
 
     def add_model(self, name: str, fields: dict[str, pw.Field], meta: dict[str, Any]) -> None:
         attrs: dict[str, Any] = {"Meta": type("Meta", (object,), meta)}
         for field_name, field in fields.items():
             self._resolve_relation(field)
+            # the field is bound to the new model
+            invalidate_fingerprint(field)
             attrs[field_name] = field
         model = type(name, (pw.Model,), attrs)
         self[name] = model
@@ -84,7 +153,7 @@ class State:
 
     def add_check_constraint(self, model_name: str, name: str, constraint: str) -> None:
         model = self[model_name]
-        costraints(model).append(pw.Check(constraint, name))
+        costraints(model).append(Check(constraint, name))
 
     def remove_check_constraint(self, model_name: str, name: str) -> None:
         model = self[model_name]
@@ -104,6 +173,7 @@ class State:
     def add_field(self, model_name: str, name: str, field: pw.Field) -> None:
         model = self[model_name]
         self._resolve_relation(field)
+        invalidate_fingerprint(field)
         if field.primary_key:
             model._meta.set_primary_key(name, field)
         else:
@@ -112,6 +182,7 @@ class State:
     def remove_field(self, model_name: str, name: str) -> None:
         model = self[model_name]
         field = model._meta.fields[name]
+        invalidate_fingerprint(field)
         model._meta.remove_field(field.name)
         delattr(model, name)
         if field.primary_key:
@@ -120,5 +191,25 @@ class State:
             delattr(model, field.object_id_name)
             delattr(field.rel_model, field.backref)
 
+    def copy(self, database: pw.Database | None = None) -> "State":
+        """
+        Return a copy of the state, the models are rebuilt on the first access.
+        If the database is given, the models of the copy are bound to it.
+        """
+        frozen = {key: self._frozen[key] if key in self._frozen else freeze_model(self.data[key]) for key in self.data}
+        if database is not None:
+            frozen = {key: f._replace(meta={**(f.meta or {}), "database": database}) for key, f in frozen.items()}
+        state = State(dict(self.data), frozen)
+        state.fingerprints = self.fingerprints.copy()
+        return state
+
     def clone(self) -> "State":
         return State({n: copy_model(m) for n, m in self.items()})
+
+
+def _rebind_relation(field: Any, rel_model: ModelCls) -> pw.Field:
+    new_field: Any = copy_field(field)
+    new_field.rel_model = rel_model
+    if isinstance(field.rel_field, pw.Field):
+        new_field.rel_field = rel_model._meta.fields[field.rel_field.name]
+    return new_field
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
+import copy
 import hashlib
 import re
-from copy import deepcopy
 from typing import TYPE_CHECKING, Any, NamedTuple
 
 import peewee as pw
@@ -10,7 +10,7 @@ import peewee as pw
 from miggy.types import ModelCls
 
 if TYPE_CHECKING:
-    from collections.abc import Sequence
+    from collections.abc import Callable, Sequence
 
     from playhouse.postgres_ext import ArrayField
 
@@ -32,11 +32,30 @@ def node_to_string(node: pw.Node) -> str:
     return ""
 
 
+# The metas of the constraint nodes are kept on the nodes in these attributes, see _node_meta.
+DEFAULT_META_ATTR = "_miggy_default_meta"
+CHECK_META_ATTR = "_miggy_check_meta"
+_UNPARSED = object()
+
+
+def _node_meta(node: pw.Node, attr: str, parse: Callable[[pw.Node], Any]) -> Any:
+    """Return the meta of the constraint node, the SQL of a foreign node is parsed once."""
+    # e.g. Entity and Table make up the attributes they don't have
+    meta = vars(node).get(attr, _UNPARSED)
+    if meta is _UNPARSED:
+        meta = vars(node)[attr] = parse(node)
+    return meta
+
+
 class DefaultMeta(NamedTuple):
     value: str
 
     @classmethod
     def from_node(cls, node: pw.Node) -> None | DefaultMeta:
+        return _node_meta(node, DEFAULT_META_ATTR, cls.parse)
+
+    @classmethod
+    def parse(cls, node: pw.Node) -> None | DefaultMeta:
         sql = node_to_string(node)
         match = re.search(r"^\s*DEFAULT\s+(.+)$", sql, re.I)
         if match:
@@ -50,6 +69,10 @@ class CheckMeta(NamedTuple):
 
     @classmethod
     def from_node(cls, node: pw.Node) -> None | CheckMeta:
+        return _node_meta(node, CHECK_META_ATTR, cls.parse)
+
+    @classmethod
+    def parse(cls, node: pw.Node) -> None | CheckMeta:
         pattern = r'(?:CONSTRAINT\s+["\']?(\w+)["\']?\s+)?CHECK\s*\((.+)\)'
         sql = node_to_string(node)
         match = re.search(pattern, sql, re.I)
@@ -64,7 +87,38 @@ class CheckMeta(NamedTuple):
         return None
 
     def as_node(self) -> pw.Node:
-        return pw.Check(constraint=self.constraint, name=self.name)
+        return Check(self.constraint, name=self.name)
+
+
+class Default(pw.SQL):
+    """
+    DEFAULT constraint, like ``pw.SQL("DEFAULT now()")``, which keeps its value,
+    so it's not parsed from the SQL when the models are compared::
+
+        created_at = pw.DateTimeField(constraints=[Default("now()")])
+    """
+
+    def __init__(self, value: str) -> None:
+        super().__init__(f"DEFAULT {value}")
+        setattr(self, DEFAULT_META_ATTR, DefaultMeta(value.strip()))
+        setattr(self, CHECK_META_ATTR, None)
+
+
+class Check(pw.NodeList):
+    """
+    CHECK constraint, like ``pw.Check``, which keeps its name and expression,
+    so they are not parsed from the SQL when the models are compared::
+
+        age = pw.IntegerField(constraints=[Check("age > 0", name="age_positive")])
+    """
+
+    def __init__(self, constraint: str, name: str | None = None) -> None:
+        check = pw.SQL(f"CHECK ({constraint})")
+        super().__init__((pw.SQL("CONSTRAINT"), pw.Entity(name), check) if name else (check,))
+        setattr(self, DEFAULT_META_ATTR, None)
+        # an unnamed constraint is parsed to raise the error
+        if name:
+            setattr(self, CHECK_META_ATTR, CheckMeta(name.strip(), constraint.strip()))
 
 
 def extract_default_meta(field: pw.Field) -> DefaultMeta | None:
@@ -171,34 +225,64 @@ def array_field(f: ArrayField) -> pw.Field:
     return f._ArrayField__field
 
 
+# The attribute of the field the fingerprint is kept in, see miggy.deconstructor.field_fingerprint.
+FINGERPRINT_ATTR = "_miggy_fingerprint"
+
+
+def invalidate_fingerprint(field: pw.Field) -> None:
+    """Drop the fingerprint of the field after it's changed, e.g. bound to another model."""
+    field.__dict__.pop(FINGERPRINT_ATTR, None)
+
+
 def copy_field(field: pw.Field) -> pw.Field:
-    # workaround for check constraint
-    # https://github.com/coleifer/peewee/issues/3067
-    if tmp_constraints := field.constraints:
-        field.constraints = []
-    new_field = deepcopy(field)
-    if tmp_constraints:
-        field.constraints = tmp_constraints
-        new_field.constraints = [c.clone() for c in tmp_constraints]
+    # A shallow copy is enough: the copy gets rebound to the new model, and nodes like
+    # check constraints or defaults are never mutated in place by the state.
+    new_field = copy.copy(field)
+    # the copy is usually changed
+    invalidate_fingerprint(new_field)
+    new_field.constraints = list(field.constraints) if field.constraints else field.constraints
+    if isinstance(field, pw.ForeignKeyField) and field.backref:
+        # the declared backref is dropped once the field is bound
+        new_field.declared_backref = field.backref  # type: ignore[attr-defined]
+    if "_ArrayField__field" in field.__dict__:
+        # the inner field is bound to the model too
+        new_field._ArrayField__field = copy.copy(array_field(field))  # type: ignore[attr-defined,arg-type]
     return new_field
 
 
-def copy_model(model_cls: ModelCls) -> ModelCls:
+class FrozenModel(NamedTuple):
+    """What is needed to rebuild a model class as it was at the time it was frozen."""
+
+    name: str
+    bases: tuple[type, ...]
+    fields: dict[str, pw.Field]
+    meta: dict[str, Any] | None
+
+
+def freeze_model(model_cls: ModelCls) -> FrozenModel:
     # this function based on ModelBase.__new__ logic
-    attrs: dict[str, Any] = {}
+    fields: dict[str, pw.Field] = {}
 
     is_pk_already_determined = False
-    # copying fields
     for k, v in model_cls.__dict__.items():
         if isinstance(v, pw.FieldAccessor):
-            attrs[k] = copy_field(v.field)
+            fields[k] = v.field
             if v.field.primary_key:
                 is_pk_already_determined = True
-    # copying Meta
-    meta_options = {}
+    meta_options: dict[str, Any] | None = None
     if hasattr(model_cls, "_meta"):
+        meta_options = {}
         base_meta = model_cls._meta
-        meta_keys = ["legacy_table_names", "table_name", "database", "indexes_state", "primary_key"]
+        meta_keys = [
+            "legacy_table_names",
+            "table_name",
+            "schema",
+            "database",
+            "indexes",
+            "indexes_state",
+            "constraints",
+            "primary_key",
+        ]
         for k in meta_keys:
             if is_pk_already_determined and k == "primary_key":
                 continue
@@ -206,8 +290,29 @@ def copy_model(model_cls: ModelCls) -> ModelCls:
                 meta_options[k] = base_meta.__dict__[k]
             except KeyError:
                 pass
-        attrs["Meta"] = type("Meta", (object,), meta_options)
-    return type(model_cls.__name__, model_cls.__bases__, attrs)
+        meta_options = _copy_meta(meta_options)
+    return FrozenModel(model_cls.__name__, model_cls.__bases__, fields, meta_options)
+
+
+def _copy_meta(meta: dict[str, Any]) -> dict[str, Any]:
+    # the index and the check constraint operations change these options in place
+    meta = dict(meta)
+    if meta.get("indexes_state") is not None:
+        meta["indexes_state"] = dict(meta["indexes_state"])
+    if meta.get("constraints") is not None:
+        meta["constraints"] = list(meta["constraints"])
+    return meta
+
+
+def thaw_model(frozen: FrozenModel) -> ModelCls:
+    attrs: dict[str, Any] = {k: copy_field(f) for k, f in frozen.fields.items()}
+    if frozen.meta is not None:
+        attrs["Meta"] = type("Meta", (object,), _copy_meta(frozen.meta))
+    return type(frozen.name, frozen.bases, attrs)
+
+
+def copy_model(model_cls: ModelCls) -> ModelCls:
+    return thaw_model(freeze_model(model_cls))
 
 
 def fk_postfix(name: str) -> str:
@@ -1,4 +1,6 @@
+import weakref
 from typing import Any
+from unittest import mock
 
 import peewee as pw
 import pytest
@@ -6,9 +8,13 @@ import pytest
 from miggy.auto import (
     IndexMeta,
     IndexMetaExtractor,
+    MigrationAutodetector,
     extract_index_meta,
+    extract_index_meta_in_order,
+    state_fingerprint,
 )
-from miggy.utils import ModelIndex
+from miggy.state import State
+from miggy.utils import ModelIndex, indexes_state
 from tests.helpers import operation_to_one_line
 
 
@@ -59,11 +65,14 @@ def test_extract_index_meta__tuple() -> None:
                 (["first_name", "last_name"], False),
             ]
 
-    assert extract_index_meta(Test) == [
+    assert extract_index_meta(Test) == {
         IndexMeta(
             model="test", fields=("first_name", "last_name"), unique=False, where=None, name="test_first_name_last_name"
         )
-    ]
+    }
+    # the model is not changed
+    assert Test._meta.indexes == [(["first_name", "last_name"], False)]
+    assert not hasattr(Test._meta, "indexes_state")
 
 
 def test_extract_index_meta__tuple__unknwon_field() -> None:
@@ -89,12 +98,29 @@ def test_extract_index_meta__advanced() -> None:
     Test.add_index(Test.first_name, unique=False, name="test_first_name")
     Test.add_index(Test.first_name, Test.last_name, unique=True, where=pw.SQL("first_name = 'bom'"), name="some_name")
 
-    assert extract_index_meta(Test) == [
+    assert extract_index_meta(Test) == {
         IndexMeta(model="test", fields=("first_name",), unique=False, where=None, name="test_first_name"),
         IndexMeta(
             model="test", fields=("first_name", "last_name"), unique=True, where="first_name = 'bom'", name="some_name"
         ),
-    ]
+    }
+
+
+def test_extract_index_meta__cache() -> None:
+    class Test(pw.Model):
+        first_name = pw.CharField()
+
+    Test.add_index(Test.first_name, name="test_first_name")
+    index_meta = extract_index_meta(Test)
+    assert extract_index_meta(Test) is index_meta
+
+    # the indexes state is changed in place by the migrations
+    index = ModelIndex(Test, (Test.first_name,), unique=True, name="first_name_unique")
+    indexes_state(Test)["first_name_unique"] = index
+    assert extract_index_meta(Test) == index_meta | {
+        IndexMeta(model="test", fields=("first_name",), name="first_name_unique", unique=True)
+    }
+    assert [i.name for i in extract_index_meta_in_order(Test)] == ["first_name_unique", "test_first_name"]
 
 
 def test_extract_index_meta__advanced__str_field_error() -> None:
@@ -130,3 +156,49 @@ def test_extract_index_meta__advanced__str_field_error() -> None:
 )
 def test_index_meta__as_operation(index_meta: IndexMeta, expected: str) -> None:
     assert operation_to_one_line(index_meta.as_operation()) == expected
+
+
+def test_autodetector_skips_unchanged_models() -> None:
+    def make_state() -> State:
+        state = State()
+        for name in ["user", "group", "profile"]:
+            state.add_model(name.title(), {"name": pw.CharField(index=True)}, {"table_name": name})
+        return state
+
+    from_state, to_state = make_state(), make_state()
+    to_state.add_field("group", "title", pw.CharField(null=True))
+
+    with mock.patch.object(MigrationAutodetector, "diff_one", autospec=True, return_value=[]) as diff_one:
+        MigrationAutodetector(from_state, to_state).changes()
+    assert [c.args[1] for c in diff_one.call_args_list] == ["group"]
+
+    fingerprint = state_fingerprint(from_state, "user")
+    assert from_state.fingerprints["user"] == fingerprint
+    assert state_fingerprint(from_state, "profile") == state_fingerprint(to_state, "profile")
+    # the model may be changed once it's got from the state
+    from_state["user"]._meta.table_name = "users"
+    assert "user" not in from_state.fingerprints
+    assert state_fingerprint(from_state, "user") != fingerprint
+
+
+def test_autodetector_sorts_dependent_operations() -> None:
+    names = [f"field_{i}" for i in range(50)]
+    from_state, to_state = State(), State()
+    from_state.add_model("Item", {"old": pw.CharField()}, {"table_name": "item", "primary_key": pw.CompositeKey("old")})
+    to_state.add_model(
+        "Item",
+        {name: pw.CharField() for name in names},
+        {"table_name": "item", "primary_key": pw.CompositeKey(*names)},
+    )
+
+    detector = MigrationAutodetector(from_state, to_state)
+    ops = [operation_to_one_line(op).split("(")[0] for op in detector.changes()]
+    assert ops.index("migrator.remove_primary_key_constraint") < ops.index("migrator.remove_field")
+    assert ops.index("migrator.add_primary_key_constraint") == len(ops) - 1
+    assert ops.count("migrator.add_field") == len(names)
+    # the primary keys are memoized on the detector, not on the class
+    assert set(detector._primary_keys) == {"item"}
+
+    ref = weakref.ref(detector)
+    del detector
+    assert ref() is None
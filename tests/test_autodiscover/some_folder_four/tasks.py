@@ -0,0 +1,2 @@
+# the modules without models are not imported
+raise ImportError("Heavy module is imported")
@@ -0,0 +1,12 @@
+import peewee as pw
+from peewee import Model as PeeweeModel
+
+BaseModel = pw.Model
+
+
+class Object4(PeeweeModel):
+    field_4 = pw.TextField(null=True)
+
+
+class Object5(BaseModel):
+    field_5 = pw.TextField(null=True)
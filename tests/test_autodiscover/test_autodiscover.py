@@ -1,4 +1,11 @@
-from miggy.router import load_models
+import ast
+import os
+import pathlib
+import sys
+from textwrap import dedent
+from unittest import mock
+
+from miggy.router import load_models, scan_models
 
 
 def fqn(obj):
@@ -13,6 +20,8 @@ def test_autodiscover_two_files_with_models():
             "tests.test_autodiscover.some_folder_one.another_models.Object1",
             "tests.test_autodiscover.some_folder_one.another_models.Object2",
             "tests.test_autodiscover.some_folder_one.one_models.Object3",
+            "tests.test_autodiscover.some_folder_one.aliased_models.Object4",
+            "tests.test_autodiscover.some_folder_one.aliased_models.Object5",
             "tests.test_autodiscover.some_folder_three.base_model_s.Model1",
             "tests.test_autodiscover.some_folder_three.nested_referenced_model_s.Model3",
             "tests.test_autodiscover.some_folder_three.referenced_model_s.Model2",
@@ -22,3 +31,88 @@ def test_autodiscover_two_files_with_models():
             "tests.test_autodiscover.some_folder_two.one_model.Object3",
         ]
     )
+
+
+def test_scan_models_cache(tmp_path: pathlib.Path) -> None:
+    (tmp_path / "models.py").write_text("import peewee as pw\n\nclass User(pw.Model):\n    pass\n")
+    (tmp_path / "admin.py").write_text("from .models import User\n\nclass Admin(User):\n    pass\n")
+    (tmp_path / "tasks.py").write_text("class Task:\n    pass\n")
+    sources = {f"app.{p.stem}": str(p) for p in tmp_path.glob("*.py")}
+    cache_path = str(tmp_path / "__pycache__" / "miggy_models.cache")
+
+    with (
+        mock.patch.object(sys, "dont_write_bytecode", False),
+        mock.patch.object(ast, "parse", wraps=ast.parse) as parse,
+    ):
+        assert scan_models(sources, cache_path) == {"app.models": ["User"], "app.admin": ["Admin"]}
+        assert parse.call_count == 3
+
+        parse.reset_mock()
+        assert scan_models(sources, cache_path) == {"app.models": ["User"], "app.admin": ["Admin"]}
+        assert not parse.called
+
+        (tmp_path / "tasks.py").write_text("from .admin import Admin\n\nclass Task(Admin):\n    pass\n")
+        os.utime(tmp_path / "tasks.py", ns=(0, 0))
+        assert scan_models(sources, cache_path)["app.tasks"] == ["Task"]
+        assert [c.args[1] for c in parse.call_args_list] == [str(tmp_path / "tasks.py")]
+
+
+def test_load_models_based_on_other_package(tmp_path: pathlib.Path, monkeypatch) -> None:
+    for package, modules in {
+        "shop_core": {
+            "models": """
+                import peewee as pw
+
+                class BaseModel(pw.Model):
+                    pass
+
+                def make_base():
+                    return BaseModel
+            """,
+        },
+        "shop_app": {
+            "models": """
+                from shop_core.models import BaseModel
+
+                class User(BaseModel):
+                    pass
+            """,
+            "admin": """
+                from . import models
+
+                class Admin(models.User):
+                    pass
+            """,
+            # the base can't be resolved from the source, so the module is imported
+            "dynamic": """
+                from shop_core.models import make_base
+
+                Base = make_base()
+
+                class Account(Base):
+                    pass
+            """,
+            "tasks": """
+                from enum import Enum
+
+                class Status(Enum):
+                    pass
+
+                raise ImportError("Module without models is imported")
+            """,
+        },
+    }.items():
+        (tmp_path / package).mkdir()
+        (tmp_path / package / "__init__.py").write_text("")
+        for name, code in modules.items():
+            (tmp_path / package / f"{name}.py").write_text(dedent(code))
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    try:
+        expected = {"shop_app.models.User", "shop_app.admin.Admin", "shop_app.dynamic.Account"}
+        # the base is imported from the package which isn't scanned
+        assert {fqn(m) for m in load_models("shop_app")} == expected | {"shop_core.models.BaseModel"}
+        assert {fqn(m) for m in load_models("shop_core", "shop_app")} == expected | {"shop_core.models.BaseModel"}
+    finally:
+        for name in [m for m in sys.modules if m.startswith(("shop_core", "shop_app"))]:
+            del sys.modules[name]
@@ -1,10 +1,19 @@
+import subprocess
+import sys
+
 import pytest
 from click.testing import CliRunner
 
 from miggy.cli import cli, get_router
+from tests.conftest import POSTGRES_DSN
 
 runner = CliRunner()
 
+# the light commands don't import the migrator, the autodetector and the database drivers
+HEAVY_MODULES = {"miggy.auto", "miggy.migrator", "miggy.operations", "miggy.schema", "miggy.serializer", "miggy.writer"}
+# microseconds miggy may take to import, it's about 10 times what it takes on a laptop
+IMPORT_TIME_BUDGET = 300_000
+
 
 @pytest.fixture
 def dir_option(tmpdir):
@@ -109,3 +118,103 @@ def test_fake(dir_option, db_option, migrations_str, router):
 
     # TODO: Find a way of testing fake. This is unclear why the following fails.
     # assert not router().done
+
+
+def test_migrate_schemas_from(tmp_path, patched_pg_db):
+    migrate_dir = tmp_path / "migrations"
+    migrate_dir.mkdir()
+    (migrate_dir / "001_user.py").write_text(
+        "import peewee as pw\n\n\n"
+        "def migrate(migrator, database, fake=False, **kwargs):\n"
+        '    migrator.create_model("user", {"name": pw.CharField()})\n'
+    )
+    schemas_file = tmp_path / "schemas.txt"
+    schemas_file.write_text("# tenants\ntenant_a\n\ntenant_b\nmissing\n")
+    for schema in ("tenant_a", "tenant_b"):
+        patched_pg_db.execute_sql(f"CREATE SCHEMA {schema}")
+    try:
+        result = runner.invoke(
+            cli,
+            [
+                "migrate",
+                f"--directory={migrate_dir}",
+                f"--database={POSTGRES_DSN}",
+                f"--schemas-from={schemas_file}",
+                "--jobs=2",
+            ],
+        )
+        assert result.exit_code == 1
+        assert "tenant_a: 001_user" in result.output
+        assert "tenant_b: 001_user" in result.output
+        assert "missing: failed" in result.output
+        assert "Schemas migrated: 2, failed: 1" in result.output
+        for schema in ("tenant_a", "tenant_b"):
+            assert patched_pg_db.table_exists("user", schema=schema)
+    finally:
+        patched_pg_db.execute_sql("DROP SCHEMA tenant_a, tenant_b CASCADE")
+
+
+def test_migrate_schemas_jobs(dir_option, db_option, tmp_path):
+    schemas_file = tmp_path / "schemas.txt"
+    schemas_file.write_text("tenant_a\n")
+    result = runner.invoke(cli, ["migrate", dir_option, db_option, f"--schemas-from={schemas_file}", "--jobs=0"])
+    assert result.exit_code == 2
+    assert "Invalid value for '--jobs': 0 is not in the range x>=1." in result.output
+
+
+def test_sqlmigrate(dir_option, db_option, migrations, router):
+    router().run("002_test")
+    result = runner.invoke(cli, ["sqlmigrate", dir_option, db_option])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["-- 003_test", "-- 004_test", "-- 005_test"]
+
+    # nothing listens on the port
+    db_option = "--database=postgresql://postgres@localhost:1/postgres"
+    result = runner.invoke(cli, ["sqlmigrate", dir_option, db_option, "--offline", "--after=004_test"])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == ["-- 005_test"]
+
+    result = runner.invoke(cli, ["sqlmigrate", dir_option, db_option, "--offline", "--after=004_unknown"])
+    assert result.exit_code == 2
+    assert "Invalid value for --after: unknown migration '004_unknown', the migrations are: 001_test," in result.output
+
+
+def test_sqlmigrate_sqlite_rebuild(tmpdir, dir_option, db_option, router):
+    tmpdir.join("001_user.py").write(
+        """
+import peewee as pw
+
+def migrate(migrator, database, fake=False, **kwargs):
+    migrator.create_model("user", {"name": pw.CharField(null=True)})
+    migrator.add_not_null("user", "name")
+"""
+    )
+    result = runner.invoke(cli, ["sqlmigrate", dir_option, db_option])
+    assert result.exit_code == 1
+    assert result.output == "Error: user.name can't be compiled to SQL, SQLite rebuilds the table from the database\n"
+
+
+def importtime(args, cwd):
+    """Run the command with -X importtime, return the cumulative import time of the top level modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "miggy", *args], cwd=cwd, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            # the nested imports are indented
+            modules[name[1:]] = int(cumulative)
+    return modules
+
+
+@pytest.mark.parametrize("command", [["--help"], ["list", "--database=sqlite:///test.db"]])
+def test_import_time(tmp_path, command):
+    modules = importtime(command, tmp_path)
+
+    assert not HEAVY_MODULES.intersection(name.strip() for name in modules)
+    if command == ["--help"]:
+        assert not {"peewee", "psycopg2"}.intersection(name.strip() for name in modules)
+    assert sum(time for name, time in modules.items() if name.startswith("miggy")) < IMPORT_TIME_BUDGET
@@ -9,12 +9,14 @@ from miggy.deconstructor import (
     ForeignKeyFieldDeconstructor,
     ModelDeconstructor,
     deconstructor_factory,
+    field_fingerprint,
     fields_not_equal,
 )
 from miggy.ext import IntEnumField
 from miggy.ext.fields import CharEnumField
+from miggy.state import State
 from miggy.types import ModelCls
-from miggy.utils import CheckMeta, DefaultMeta
+from miggy.utils import CheckMeta, DefaultMeta, copy_field
 from tests.helpers import Rating, Status, get_active_status, get_inactive_status
 
 
@@ -404,3 +406,23 @@ def test_model_deconstructor__deconstruct(model: ModelCls, expected: dict[str, A
     if "primary_key" in deconstructed["meta"]:
         deconstructed["meta"]["primary_key"] = deconstructed["meta"]["primary_key"].field_names
     assert deconstructed == expected
+
+
+def test_field_fingerprint() -> None:
+    state = State()
+    state.add_model("User", {"name": pw.CharField(max_length=64)}, {})
+    field = state["user"].name
+    fingerprint = field_fingerprint(field)
+
+    assert field_fingerprint(field) is fingerprint
+    assert fingerprint.deconstructed == deconstructor_factory(field).deconstruct()
+    assert fingerprint.column_type == ("VARCHAR", (64,))
+    assert fingerprint == field_fingerprint(copy_field(field))
+    assert hash(fingerprint) == hash(field_fingerprint(copy_field(field)))
+
+    # the state binds the field to the model
+    title = pw.CharField(column_name="title")
+    assert field_fingerprint(title).deconstructed.params == {"column_name": "title"}
+    state.add_field("user", "title", title)
+    assert field_fingerprint(title).deconstructed.params == {}
+    assert field_fingerprint(title).digest != fingerprint.digest
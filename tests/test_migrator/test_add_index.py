@@ -12,19 +12,22 @@ from tests.conftest import PatchedPgDatabase
     [
         (
             {"safe": False},
-            """CREATE INDEX "some_name" ON "company" ("name") WHERE name='sdfsfad'""",
+            ["""CREATE INDEX "some_name" ON "company" ("name") WHERE name='sdfsfad'"""],
         ),
         (
             {"safe": True},
-            """CREATE INDEX IF NOT EXISTS "some_name" ON "company" ("name") WHERE name='sdfsfad'""",
+            ["""CREATE INDEX IF NOT EXISTS "some_name" ON "company" ("name") WHERE name='sdfsfad'"""],
         ),
         (
             {"concurrently": True},
-            """CREATE INDEX CONCURRENTLY "some_name" ON "company" ("name") WHERE name='sdfsfad'""",
+            [
+                """SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass("some_name")""",
+                """CREATE INDEX CONCURRENTLY "some_name" ON "company" ("name") WHERE name='sdfsfad'""",
+            ],
         ),
     ],
 )
-def test_add_index(patched_pg_db: PatchedPgDatabase, index_params: dict[str, Any], expected: str) -> None:
+def test_add_index(patched_pg_db: PatchedPgDatabase, index_params: dict[str, Any], expected: list[str]) -> None:
     migrator = Migrator(patched_pg_db)
 
     @migrator.create_model
@@ -37,4 +40,35 @@ def test_add_index(patched_pg_db: PatchedPgDatabase, index_params: dict[str, Any
     migrator.add_index("company", "name", where=pw.SQL("name='sdfsfad'"), name="some_name", **index_params)
 
     migrator.run()
-    assert patched_pg_db.queries == [expected]
+    assert patched_pg_db.queries == expected
+
+
+def _index_names(db: pw.Database) -> list[str]:
+    cursor = db.execute_sql("SELECT indexname FROM pg_indexes WHERE tablename = 'company' ORDER BY indexname")
+    return [name for (name,) in cursor.fetchall()]
+
+
+def test_add_index_concurrently_drops_invalid_index(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db)
+
+    migrator.create_model("company", {"name": pw.CharField()})
+    migrator.run()
+    Company = migrator.state["company"]
+    Company.insert_many([{"name": "a"}, {"name": "a"}]).execute()
+
+    # a failed build leaves an invalid index behind, it's dropped
+    migrator.add_index("company", "name", name="company_name", unique=True, concurrently=True)
+    with pytest.raises(pw.IntegrityError):
+        migrator.run()
+    assert _index_names(patched_pg_db) == ["company_pkey"]
+
+    # an invalid index left by an interrupted migration is dropped before the build
+    with pytest.raises(pw.IntegrityError):
+        patched_pg_db.execute_sql('CREATE UNIQUE INDEX CONCURRENTLY "company_name" ON "company" ("name")')
+    Company.delete().where(Company.id == 2).execute()
+    migrator.clean()
+    migrator.add_index("company", "name", name="company_name", unique=True, safe=True, concurrently=True)
+    migrator.run()
+    assert _index_names(patched_pg_db) == ["company_name", "company_pkey"]
+    cursor = patched_pg_db.execute_sql("SELECT indisvalid FROM pg_index WHERE indexrelid = 'company_name'::regclass")
+    assert cursor.fetchone() == (True,)
@@ -1,4 +1,5 @@
 import peewee as pw
+import pytest
 
 from miggy import Migrator, types
 from tests.conftest import PatchedPgDatabase
@@ -44,3 +45,65 @@ def test_drop_not_null(patched_pg_db: PatchedPgDatabase) -> None:
     ]
     assert migrator.state["user"].name.null
     assert migrator.state["user"].created_at.null
+
+
+def test_add_not_null_online(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db, batch_sql=True)
+
+    @migrator.create_table
+    class User(types.Model):
+        name = pw.CharField(null=True)
+        login = pw.CharField(null=True)
+
+    migrator.run()
+    patched_pg_db.clear_queries()
+
+    migrator.add_not_null("user", "name", online=True)
+    migrator.add_field("user", "email", pw.CharField(default=""), online=True)
+    migrator.alter_field("user", "login", pw.CharField(max_length=100), online=True)
+    # a transaction would hold the lock until it ends, so NOT NULL is added outside of it
+    assert [phase.atomic for phase in migrator.migration.phases] == [False, True, False, True, False]
+    migrator.run()
+
+    def add_not_null_online(column: str) -> list[str]:
+        return [
+            f'ALTER TABLE "user" DROP CONSTRAINT IF EXISTS "user_{column}_not_null"',
+            f'ALTER TABLE "user" ADD CONSTRAINT "user_{column}_not_null" CHECK ("{column}" IS NOT NULL) NOT VALID',
+            f'ALTER TABLE "user" VALIDATE CONSTRAINT "user_{column}_not_null"',
+            f'ALTER TABLE "user" ALTER COLUMN "{column}" SET NOT NULL',
+            f'ALTER TABLE "user" DROP CONSTRAINT "user_{column}_not_null"',
+        ]
+
+    assert patched_pg_db.queries == [
+        *add_not_null_online("name"),
+        'ALTER TABLE "user" ADD COLUMN "email" VARCHAR(255)\n;\nUPDATE "user" SET "email" = ',
+        *add_not_null_online("email"),
+        'ALTER TABLE "user" ALTER COLUMN "login" TYPE VARCHAR(100)',
+        *add_not_null_online("login"),
+    ]
+    assert not migrator.state["user"].name.null
+    columns = {c.name: c for c in patched_pg_db.get_columns("user")}
+    assert not columns["name"].null
+    assert not columns["email"].null
+    assert not columns["login"].null
+
+
+def test_add_not_null_online_retry(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db)
+    migrator.create_model("user", {"name": pw.CharField(null=True)})
+    migrator.run()
+    patched_pg_db.execute_sql('INSERT INTO "user" (name) VALUES (NULL)')
+
+    migrator.add_not_null("user", "name", online=True)
+    with pytest.raises(pw.IntegrityError):
+        migrator.run()
+
+    # the constraint left by the failed validation doesn't prevent the next attempt
+    patched_pg_db.execute_sql("UPDATE \"user\" SET name = ''")
+    migrator.clean()
+    migrator.add_not_null("user", "name", online=True)
+    migrator.run()
+    columns = {c.name: c for c in patched_pg_db.get_columns("user")}
+    assert not columns["name"].null
+    cursor = patched_pg_db.execute_sql("SELECT conname FROM pg_constraint WHERE conrelid = '\"user\"'::regclass")
+    assert [name for (name,) in cursor.fetchall()] == ["user_pkey"]
@@ -293,3 +293,190 @@ def test_rename_table(patched_pg_db: PatchedPgDatabase) -> None:
         'ALTER INDEX "user_first_name" RENAME TO "new_name_first_name"',
         'ALTER INDEX "user_last_name" RENAME TO "new_name_last_name"',
     ]
+
+
+def test_state_only(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db)
+
+    with migrator.state_only():
+
+        @migrator.create_table
+        class User(pw.Model):
+            first_name = pw.CharField()
+
+        migrator.add_fields("user", last_name=pw.CharField(null=True))
+        migrator.python(lambda *_: None)
+
+    assert migrator.migration.operations == []
+    migrator.run(change_schema=False)
+
+    User = migrator.state["user"]
+    assert "last_name" in User._meta.fields
+    assert User._meta.database is patched_pg_db
+    assert patched_pg_db.queries == []
+
+
+def test_run_non_atomic_in_order(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db)
+    migrator.create_model("user", {"name": pw.CharField(null=True)})
+    migrator.run()
+
+    # the operations after a non atomic one are run after it
+    migrator.add_index("user", "name", name="user_name", concurrently=True)
+    migrator.drop_index("user", "user_name")
+    migrator.backfill("user", "name", "")
+    migrator.add_not_null("user", "name")
+    migrator.add_field("user", "email", pw.CharField(default="x"), online=True)
+    migrator.add_index("user", "email", name="user_email")
+    assert [phase.atomic for phase in migrator.migration.phases] == [False, True, False, True, False, True]
+    migrator.run()
+
+    cursor = patched_pg_db.execute_sql("SELECT indexname FROM pg_indexes WHERE tablename = 'user' ORDER BY indexname")
+    assert [name for (name,) in cursor.fetchall()] == ["user_email", "user_pkey"]
+    assert migrator.migration.phases == []
+
+
+def test_batch_sql(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db, batch_sql=True)
+
+    @migrator.create_table
+    class Customer(pw.Model):
+        name = pw.CharField()
+
+    @migrator.create_table
+    class User(pw.Model):
+        first_name = pw.CharField()
+        customer = pw.ForeignKeyField(Customer, null=True)
+
+    migrator.run()
+    patched_pg_db.clear_queries()
+
+    migrator.add_fields("user", last_name=pw.CharField(null=True, index=True))
+    migrator.sql('UPDATE "user" SET last_name = %s -- a comment', ("Doe",))
+    migrator.change_fields("user", customer=pw.IntegerField(null=True, column_name="customer_id"))
+    migrator.drop_not_null("user", "first_name")
+    migrator.run()
+
+    first_batch, fk_lookup, second_batch = patched_pg_db.queries
+    assert first_batch.split("\n;\n") == [
+        'ALTER TABLE "user" ADD COLUMN "last_name" VARCHAR(255)',
+        'CREATE INDEX "user_last_name" ON "user" ("last_name")',
+        'UPDATE "user" SET last_name = Doe -- a comment',
+    ]
+    # the foreign key lookup sees the changes of the first batch
+    assert "FROM pg_constraint" in fk_lookup
+    assert second_batch.split("\n;\n") == [
+        'ALTER TABLE "user" DROP CONSTRAINT "user_customer_id_fkey"',
+        'DROP INDEX "user_customer_id"',
+        'ALTER TABLE "user" ALTER COLUMN "first_name" DROP NOT NULL',
+    ]
+
+
+def test_batch_sql_coalesce_alter_table(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db, batch_sql=True)
+
+    @migrator.create_table
+    class User(pw.Model):
+        first_name = pw.CharField()
+        last_name = pw.CharField()
+
+    migrator.run()
+    patched_pg_db.clear_queries()
+
+    migrator.add_fields("user", age=pw.IntegerField(null=True), email=pw.CharField(default="x"))
+    migrator.drop_not_null("user", "first_name")
+    migrator.rename_field("user", "last_name", "surname")
+    migrator.drop_columns("user", "age")
+    migrator.run()
+
+    assert patched_pg_db.queries[-1].split("\n;\n") == [
+        'ALTER TABLE "user" ADD COLUMN "age" INTEGER, ADD COLUMN "email" VARCHAR(255)',
+        'UPDATE "user" SET "email" = x',
+        'ALTER TABLE "user" ALTER COLUMN "email" SET NOT NULL, ALTER COLUMN "first_name" DROP NOT NULL',
+        'ALTER TABLE "user" RENAME COLUMN "last_name" TO "surname"',
+        'ALTER TABLE "user" DROP COLUMN "age"',
+    ]
+
+
+def test_sqlite_single_table_rebuild() -> None:
+    class RecordingSqliteDatabase(pw.SqliteDatabase):
+        queries: list[str] = []
+
+        def execute_sql(self, sql, params=None):
+            self.queries.append(sql)
+            return super().execute_sql(sql, params)
+
+    database = RecordingSqliteDatabase(":memory:")
+    migrator = Migrator(database)
+
+    @migrator.create_table
+    class Customer(pw.Model):
+        name = pw.CharField()
+
+    @migrator.create_table
+    class Order(pw.Model):
+        number = pw.CharField(index=True)
+        amount = pw.IntegerField()
+        note = pw.CharField()
+        customer = pw.ForeignKeyField(Customer)
+
+    migrator.run()
+    customer = migrator.state["customer"].create(name="John")
+    migrator.state["order"].create(number="1", amount=10, note="", customer=customer)
+    database.queries.clear()
+
+    migrator.change_fields("order", amount=pw.BigIntegerField())
+    migrator.change_fields("order", note=pw.CharField(null=True, constraints=[pw.SQL("DEFAULT 'empty'")]))
+    migrator.drop_not_null("order", "number")
+    migrator.drop_columns("order", "customer")
+    migrator.run()
+
+    assert sum(q.startswith("DROP TABLE IF EXISTS") for q in database.queries) == 1
+    columns = {c.name: c for c in database.get_columns("order")}
+    assert set(columns) == {"id", "number", "amount", "note"}
+    assert columns["note"].null and columns["number"].null
+    assert columns["note"].default == "'empty'"
+    assert [i.columns for i in database.get_indexes("order")] == [["number"]]
+    assert not database.get_foreign_keys("order")
+    assert database.execute_sql('SELECT number, amount, note FROM "order"').fetchall() == [("1", 10, "")]
+
+
+def test_sqlite_failed_rebuild_is_dropped() -> None:
+    database = pw.SqliteDatabase(":memory:")
+    database.execute_sql('CREATE TABLE "order" ("id" INTEGER PRIMARY KEY, "number" VARCHAR(255) NOT NULL)')
+    schema_migrator = SchemaMigrator.from_database(database)
+
+    # the field is missing, so the second operation fails before the rebuild is run
+    operations = [schema_migrator.drop_not_null("order", "number"), Operation(schema_migrator, "add_column", "order")]
+    with pytest.raises(TypeError):
+        schema_migrator.run_operations(operations)
+
+    schema_migrator.run_operations([schema_migrator.add_column("order", "note", pw.CharField(null=True))])
+    columns = {c.name: c for c in database.get_columns("order")}
+    assert set(columns) == {"id", "number", "note"}
+    assert not columns["number"].null
+
+
+def test_batch_sql_actions_on_added_column(patched_pg_db: PatchedPgDatabase) -> None:
+    migrator = Migrator(patched_pg_db, batch_sql=True)
+
+    @migrator.create_table
+    class User(pw.Model):
+        first_name = pw.CharField()
+
+    migrator.run()
+    patched_pg_db.clear_queries()
+
+    # PostgreSQL changes the types before it adds the columns of a statement
+    migrator.add_fields("user", score=pw.IntegerField(null=True), nick=pw.CharField(null=True))
+    migrator.change_fields("user", score=pw.BigIntegerField(null=True))
+    migrator.drop_not_null("user", "nick")
+    migrator.run()
+
+    assert patched_pg_db.queries[-1].split("\n;\n") == [
+        'ALTER TABLE "user" ADD COLUMN "score" INTEGER, ADD COLUMN "nick" VARCHAR(255)',
+        'ALTER TABLE "user" ALTER COLUMN "score" TYPE BIGINT, ALTER COLUMN "nick" DROP NOT NULL',
+    ]
+    columns = {c.name: c for c in patched_pg_db.get_columns("user")}
+    assert columns["score"].data_type == "bigint"
+    assert columns["nick"].null
@@ -127,7 +127,7 @@ def test_handle_fk_constraint(
     run_operations(operation.database_forwards(SchemaMigrator.from_database(patched_pg_db), from_state, to_state))
 
     # remove query for constraints
-    queries = [q for q in patched_pg_db.queries if "FROM information_schema.table_constraints" not in q]
+    queries = [q for q in patched_pg_db.queries if "FROM pg_constraint" not in q]
     assert queries == expected
 
 
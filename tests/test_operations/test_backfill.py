@@ -0,0 +1,75 @@
+import peewee as pw
+import pytest
+
+from miggy.operations import Backfill
+from miggy.schema import SchemaMigrator
+from miggy.state import State
+from tests.conftest import PatchedPgDatabase
+
+
+def test_state_forwards() -> None:
+
+    class User(pw.Model):
+        name = pw.CharField(null=True)
+
+    state = State({"user": User})
+    Backfill("user", "name", "").state_forwards(state)
+    assert state["user"].name.null
+
+
+def test_database_forwards(patched_pg_db: PatchedPgDatabase) -> None:
+
+    class User(pw.Model):
+        name = pw.CharField(null=True)
+
+        class Meta:
+            database = patched_pg_db
+
+    User.create_table()
+    User.insert_many([{"name": None if i % 2 else "x"} for i in range(5)]).execute()
+    patched_pg_db.clear_queries()
+
+    to_state = State({"user": User})
+    operation = Backfill("user", "name", "y", batch_size=2)
+
+    operation.database_forwards(SchemaMigrator.from_database(patched_pg_db), State(), to_state)[0]()
+
+    assert patched_pg_db.queries == [
+        'SELECT "t1"."id" FROM "user" AS "t1" WHERE ("t1"."name" IS NULL) ORDER BY "t1"."id" LIMIT 2',
+        'UPDATE "user" SET "name" = y WHERE ("user"."id" IN (2, 4))',
+        'SELECT "t1"."id" FROM "user" AS "t1" WHERE (("t1"."name" IS NULL) AND ("t1"."id" > 4)) '
+        'ORDER BY "t1"."id" LIMIT 2',
+    ]
+    assert sorted(name for (name,) in User.select(User.name).tuples()) == ["x", "x", "x", "y", "y"]
+
+
+def test_database_forwards_in_transaction(patched_pg_db: PatchedPgDatabase) -> None:
+
+    class User(pw.Model):
+        name = pw.CharField(null=True, default="default")
+
+        class Meta:
+            database = patched_pg_db
+
+    User.create_table()
+    User.insert_many([{"name": None}] * 3).execute()
+
+    to_state = State({"user": User})
+    backfill = Backfill("user", "name", batch_size=1).database_forwards(
+        SchemaMigrator.from_database(patched_pg_db), State(), to_state
+    )[0]
+
+    # the transaction of the caller isn't committed
+    with pytest.raises(RuntimeError, match="can't be run in a transaction"), patched_pg_db.transaction():
+        backfill()
+    assert [name for (name,) in User.select(User.name).tuples()] == [None] * 3
+
+
+def test_database_forwards_without_value() -> None:
+
+    class User(pw.Model):
+        name = pw.CharField(null=True)
+
+    operation = Backfill("user", "name")
+    with pytest.raises(ValueError):
+        operation.database_forwards(SchemaMigrator(pw.SqliteDatabase(":memory:")), State(), State({"user": User}))
@@ -1,20 +1,36 @@
+import importlib.util
+import logging
 import os
 import pathlib
+import shutil
+import sys
+import threading
 from textwrap import dedent
 from unittest import mock
 
 import peewee as pw
-import playhouse
+import playhouse.db_url
 import pytest
 from playhouse.postgres_ext import Psycopg3Database
 
 from miggy.cli import get_router
-from miggy.router import Router, detect_changes
+from miggy.router import MigrationPlan, Router, detect_changes
 from miggy.state import State
-from tests.conftest import POSTGRES_DSN
+from tests.conftest import POSTGRES_DSN, PatchedPgDatabase
 from tests.helpers import get_active_status
 
 
+def test_router_lazy_attributes() -> None:
+    import miggy.router
+    from miggy.migrator import Migrator
+    from miggy.router import Migrator as RouterMigrator
+
+    # the names imported by the module before are still importable from it
+    assert RouterMigrator is Migrator
+    with pytest.raises(AttributeError, match="has no attribute 'missing'"):
+        miggy.router.missing  # noqa: B018
+
+
 def test_router_run_already_applied_ok(router: Router) -> None:
     router.run()
     Person = router.migrator.state["person"]
@@ -38,8 +54,10 @@ def test_router_todo_diff_done(router: Router, migrations_dir: pathlib.Path):
     assert router.todo == ["001_test", "002_test", "003_tespy", "004_test_insert", "005_new"]
     os.remove(os.path.join(migrations_dir, "005_new.py"))
 
+    # the history is loaded once per router
     MigrateHistory.create(name="001_test")
-    assert router.diff == ["002_test", "003_tespy", "004_test_insert"]
+    assert router.diff == ["001_test", "002_test", "003_tespy", "004_test_insert"]
+    assert get_router(migrations_dir, router.database).diff == ["002_test", "003_tespy", "004_test_insert"]
     MigrateHistory.delete().execute()
 
 
@@ -152,3 +170,367 @@ def test_compile(tmp_path: pathlib.Path) -> None:
             )
             in content
         )
+
+
+@mock.patch("sys.dont_write_bytecode", False)
+def test_router_state_cache(tmp_path: pathlib.Path, migrations_dir: pathlib.Path) -> None:
+    migrate_dir = tmp_path / "migrations"
+    shutil.copytree(migrations_dir, migrate_dir)
+    db = playhouse.db_url.connect("sqlite:///%s" % (tmp_path / "test.db"))
+
+    def make_router() -> Router:
+        return Router(db, migrate_dir=str(migrate_dir), state_cache=True)
+
+    make_router().run()
+    expected = make_router().migration_state
+    assert os.path.exists(make_router().state_cache_path)
+
+    with mock.patch.object(Router, "run_one") as mocked:
+        state = make_router().migration_state
+        assert not mocked.called
+    assert set(state.fingerprints) == set(state)
+    assert not detect_changes(state, expected)
+    assert state["person"].get_or_none(email="person@example.com") is not None
+
+    # Changed migrations invalidate the cache
+    with open(migrate_dir / "003_tespy.py", "a") as f:
+        f.write("\n")
+    with mock.patch.object(Router, "run_one") as mocked:
+        make_router().migration_state  # noqa: B018
+        assert mocked.call_count == 4
+
+
+def test_router_state_cache_not_saved(tmp_path: pathlib.Path, migrations_dir: pathlib.Path) -> None:
+    migrate_dir = tmp_path / "migrations"
+    shutil.copytree(migrations_dir, migrate_dir)
+    router = Router(pw.SqliteDatabase(":memory:"), migrate_dir=str(migrate_dir), state_cache=True)
+    router.run()
+
+    with mock.patch("sys.dont_write_bytecode", True):
+        router.dump_state_cache(router.migration_state, [(name, router.hash(name)) for name in router.done])
+    assert not os.path.exists(router.state_cache_path)
+
+    # e.g. a read-only checkout, the migrations are applied anyway
+    with mock.patch("sys.dont_write_bytecode", False), mock.patch("os.makedirs", side_effect=PermissionError):
+        router.dump_state_cache(router.migration_state, [(name, router.hash(name)) for name in router.done])
+    assert not os.path.exists(router.state_cache_path)
+
+
+def test_router_watch(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    package = tmp_path / "watched_app"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    models = """
+        import peewee as pw
+
+        class User(pw.Model):
+            name = pw.CharField()
+    """
+    (package / "models.py").write_text(dedent(models))
+    (package / "profile.py").write_text(
+        dedent(
+            """
+            import peewee as pw
+            from watched_app.models import User
+
+            class Profile(pw.Model):
+                user = pw.ForeignKeyField(User)
+            """
+        )
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    migrate_dir = tmp_path / "migrations"
+    router = Router(pw.SqliteDatabase(":memory:"), migrate_dir=str(migrate_dir))
+
+    watcher = router.watch(lambda: "auto", auto="watched_app", interval=0.01)
+    try:
+        assert next(watcher) == "001_auto"
+        (package / "models.py").write_text(dedent(models) + "    email = pw.CharField(null=True)\n")
+        with mock.patch.object(Router, "run_one", autospec=True, side_effect=Router.run_one) as run_one:
+            assert next(watcher) == "002_auto"
+        # only the new migration is replayed into the kept state
+        assert [c.args[1] for c in run_one.call_args_list] == ["001_auto"]
+        migration = (migrate_dir / "002_auto.py").read_text()
+        assert "migrator.add_field(\n        model_name='user',\n        name='email'," in migration
+        # the modules referring to the changed models are imported again
+        profile = sys.modules["watched_app.profile"].Profile
+        assert profile.user.rel_model is sys.modules["watched_app.models"].User
+
+        # a broken source is reported once, the migration is created when it's fixed
+        (package / "models.py").write_text(dedent(models) + "    email = pw.CharField(null=True\n")
+        fixed = dedent(models) + "    email = pw.CharField(null=True)\n    age = pw.IntegerField(null=True)\n"
+        (package / "fixed.txt").write_text(fixed)
+        # the file is replaced at once, so the watcher doesn't see it half written
+        timer = threading.Timer(0.2, os.replace, [package / "fixed.txt", package / "models.py"])
+        timer.start()
+        with caplog.at_level(logging.ERROR, logger="miggy"):
+            assert next(watcher) == "003_auto"
+        timer.join()
+        assert [r.message for r in caplog.records if r.levelno == logging.ERROR] == ["Can't create migration"]
+    finally:
+        watcher.close()
+        for name in [m for m in sys.modules if m.startswith("watched_app")]:
+            del sys.modules[name]
+
+
+def test_router_read_bytecode_cache(tmp_path: pathlib.Path, migrations_dir: pathlib.Path) -> None:
+    migrate_dir = tmp_path / "migrations"
+    shutil.copytree(migrations_dir, migrate_dir)
+    router = Router(playhouse.db_url.connect("sqlite:///:memory:"), migrate_dir=str(migrate_dir))
+
+    with mock.patch("sys.dont_write_bytecode", False):
+        migration = router.read("003_tespy")
+
+    assert migration.atomic is True
+    assert os.path.exists(importlib.util.cache_from_source(str(migrate_dir / "003_tespy.py")))
+
+
+def test_router_checkpoint(tmp_path: pathlib.Path, migrations_dir: pathlib.Path) -> None:
+    migrate_dir = tmp_path / "migrations"
+    shutil.copytree(migrations_dir, migrate_dir)
+    db = playhouse.db_url.connect("sqlite:///%s" % (tmp_path / "test.db"))
+
+    def make_router() -> Router:
+        return Router(db, migrate_dir=str(migrate_dir))
+
+    router = make_router()
+    router.run()
+    expected = router.migration_state
+
+    assert router.checkpoint() == "005_checkpoint"
+    assert router.read("005_checkpoint").replaces == ["001_test", "002_test", "003_tespy", "004_test_insert"]
+    router.create("empty")
+    assert make_router().run() == ["005_checkpoint", "006_empty"]
+
+    with (
+        mock.patch.object(Router, "run_one") as mocked,
+        mock.patch.object(Router, "read", autospec=True, side_effect=Router.read) as read,
+    ):
+        state = make_router().migration_state
+        assert [c.args[0] for c in mocked.call_args_list] == ["006_empty"]
+    # only the checkpoint is run to restore the state
+    assert [c.args[1] for c in read.call_args_list] == ["005_checkpoint"]
+    assert make_router().read_replaces("006_empty") == []
+    assert not detect_changes(state, expected)
+
+    # the list is wrapped by a formatter
+    checkpoint = migrate_dir / "005_checkpoint.py"
+    source = checkpoint.read_text()
+    replaces = '__REPLACES = ["001_test", "002_test", "003_tespy", "004_test_insert"]'
+    assert replaces in source.replace("'", '"')
+    wrapped = '__REPLACES = [\n    "001_test",\n    "002_test",\n    "003_tespy",\n    "004_test_insert",\n]'
+    checkpoint.write_text(source.replace("'", '"').replace(replaces, wrapped))
+    assert make_router().read_replaces("005_checkpoint") == ["001_test", "002_test", "003_tespy", "004_test_insert"]
+    with mock.patch.object(Router, "run_one") as mocked:
+        make_router().migration_state  # noqa: B018
+        assert [c.args[0] for c in mocked.call_args_list] == ["006_empty"]
+
+    # The checkpoint is not used until all the replaced migrations are applied
+    router = make_router()
+    router.rollback("006_empty")
+    router.rollback("005_checkpoint")
+    with mock.patch.object(Router, "run_one") as mocked:
+        make_router().migration_state  # noqa: B018
+        assert mocked.call_count == 4
+
+
+def test_router_run_concurrent_index(tmp_path: pathlib.Path, patched_pg_db: PatchedPgDatabase) -> None:
+    (tmp_path / "001_index.py").write_text(
+        dedent(
+            """
+            import peewee as pw
+
+            def migrate(migrator, database, fake=False, **kwargs):
+                @migrator.create_model
+                class Company(pw.Model):
+                    name = pw.CharField()
+
+                migrator.add_index("company", "name", name="company_name", concurrently=True)
+
+            __ATOMIC = True
+            """
+        )
+    )
+    router = Router(patched_pg_db, migrate_dir=str(tmp_path))
+
+    assert router.run() == ["001_index"]
+    assert router.done == ["001_index"]
+    cursor = patched_pg_db.execute_sql("SELECT indisvalid FROM pg_index WHERE indexrelid = 'company_name'::regclass")
+    assert cursor.fetchone() == (True,)
+
+
+def test_router_run_backfill(tmp_path: pathlib.Path, patched_pg_db: PatchedPgDatabase) -> None:
+    (tmp_path / "001_user.py").write_text(
+        dedent(
+            """
+            import peewee as pw
+
+            def migrate(migrator, database, fake=False, **kwargs):
+                @migrator.create_model
+                class User(pw.Model):
+                    name = pw.CharField()
+            """
+        )
+    )
+    migration = """
+        import peewee as pw
+
+        def migrate(migrator, database, fake=False, **kwargs):
+            migrator.add_field("user", "email", pw.CharField(null=True))
+            migrator.sql("{sql}")
+            migrator.backfill("user", "email", "", batch_size=1)
+            migrator.add_not_null("user", "email")
+    """
+    (tmp_path / "002_email.py").write_text(dedent(migration.format(sql="SELECT missing")))
+    router = Router(patched_pg_db, migrate_dir=str(tmp_path))
+    router.run("001_user")
+    patched_pg_db.execute_sql("INSERT INTO \"user\" (name) VALUES ('a'), ('b')")
+
+    # the backfill is run after the transaction, which is rolled back
+    with pytest.raises(pw.ProgrammingError):
+        router.run()
+    assert router.done == ["001_user"]
+    assert "email" not in {c.name for c in patched_pg_db.get_columns("user")}
+
+    (tmp_path / "002_email.py").write_text(dedent(migration.format(sql="SELECT 1")))
+    assert Router(patched_pg_db, migrate_dir=str(tmp_path)).run() == ["002_email"]
+    assert patched_pg_db.execute_sql('SELECT email FROM "user"').fetchall() == [("",), ("",)]
+    # the operations after the backfill are run after it
+    assert not {c.name: c for c in patched_pg_db.get_columns("user")}["email"].null
+
+
+def test_router_history(router: Router, patched_pg_db: PatchedPgDatabase) -> None:
+    assert router.run() == ["001_test", "002_test", "003_tespy", "004_test_insert"]
+    router.rollback("004_test_insert")
+
+    patched_pg_db.clear_queries()
+    assert router.done == ["001_test", "002_test", "003_tespy"]
+    assert router.diff == ["004_test_insert"]
+    assert not [q for q in patched_pg_db.queries if "migratehistory" in q]
+
+    with pytest.raises(pw.IntegrityError), patched_pg_db.atomic():
+        router.model.create(name="001_test")
+
+
+def test_router_rollback_to(tmp_path: pathlib.Path, patched_pg_db: PatchedPgDatabase) -> None:
+    (tmp_path / "001_user.py").write_text(
+        dedent(
+            """
+            import peewee as pw
+
+            def migrate(migrator, database, fake=False, **kwargs):
+                migrator.create_model("user", {"name": pw.CharField()})
+
+            def rollback(migrator, database, fake=False, **kwargs):
+                migrator.remove_model("user")
+            """
+        )
+    )
+    for num, field in enumerate(["email", "phone"], 2):
+        (tmp_path / f"00{num}_{field}.py").write_text(
+            dedent(
+                f"""
+                import peewee as pw
+
+                def migrate(migrator, database, fake=False, **kwargs):
+                    migrator.add_field("user", "{field}", pw.CharField(null=True))
+
+                def rollback(migrator, database, fake=False, **kwargs):
+                    assert "{field}" in migrator.state["user"]._meta.fields
+                    migrator.remove_field("user", "{field}")
+                """
+            )
+        )
+    Router(patched_pg_db, migrate_dir=str(tmp_path)).run()
+
+    router = Router(patched_pg_db, migrate_dir=str(tmp_path))
+    with mock.patch.object(Router, "run_one", autospec=True, side_effect=Router.run_one) as mocked:
+        assert router.rollback_to("001_user") == ["003_phone", "002_email"]
+    # every migration is replayed once
+    assert [c.args[1] for c in mocked.call_args_list if not c.kwargs] == ["001_user", "002_email", "003_phone"]
+    assert router.done == ["001_user"]
+    assert list(router.migrator.state["user"]._meta.fields) == ["id", "name"]
+    assert [c.name for c in patched_pg_db.get_columns("user")] == ["id", "name"]
+
+    with pytest.raises(RuntimeError, match="Unable to rollback 2 migrations"):
+        router.rollback(count=2)
+    assert router.rollback(count=1) == ["001_user"]
+    assert router.done == []
+
+
+def test_migration_plan(tmp_path: pathlib.Path, migrations_dir: pathlib.Path) -> None:
+    db = playhouse.db_url.connect("sqlite:///%s" % (tmp_path / "test.db"))
+    plan = MigrationPlan(Router(db, migrate_dir=str(migrations_dir)))
+    expected = Router(db, migrate_dir=str(migrations_dir)).run()
+
+    with mock.patch.object(Router, "run_one") as mocked:
+        for _ in range(2):
+            state = Router(db, migrate_dir=str(migrations_dir), plan=plan).migration_state
+            assert not mocked.called
+            assert not detect_changes(state, plan.states[-1])
+    assert state["person"].get_or_none(email="person@example.com") is not None
+    assert state["person"]._meta.database is db
+
+    # a router with a partial history is migrated from the state after it
+    Router(db, migrate_dir=str(migrations_dir)).rollback(count=2)
+    assert Router(db, migrate_dir=str(migrations_dir), plan=plan).run() == expected[-2:]
+
+
+def test_router_plan_sql(tmp_path: pathlib.Path, patched_pg_db: PatchedPgDatabase) -> None:
+    migrations = {
+        "001_init": """
+            import peewee as pw
+
+            def migrate(migrator, database, fake=False, **kwargs):
+                # the code changing the data is skipped for the applied migrations
+                database.data_changed = not fake
+                migrator.create_model("customer", {"name": pw.CharField()})
+                migrator.create_model(
+                    "order", {"customer": pw.ForeignKeyField(model="customer", field="id", column_name="customer_id")}
+                )
+            """,
+        "002_purchase": """
+            def migrate(migrator, database, fake=False, **kwargs):
+                migrator.rename_table("order", "purchase")
+            """,
+        "003_note": """
+            import peewee as pw
+
+            def migrate(migrator, database, fake=False, **kwargs):
+                migrator.alter_field("order", "customer", pw.IntegerField(column_name="customer_id"))
+                migrator.add_field("order", "note", pw.CharField(null=True))
+                migrator.sql("UPDATE purchase SET note = %s", ("50%",))
+                migrator.python(lambda migrator, state: None)
+            """,
+    }
+    for name, code in migrations.items():
+        (tmp_path / f"{name}.py").write_text(dedent(code))
+    expected = [
+        "-- 002_purchase",
+        'ALTER TABLE "order" RENAME TO "purchase"',
+        'ALTER SEQUENCE IF EXISTS "order_id_seq" RENAME TO "purchase_id_seq"',
+        'ALTER INDEX "order_customer_id" RENAME TO "purchase_customer_id"',
+        "-- 003_note",
+        'ALTER TABLE "purchase" DROP CONSTRAINT "order_customer_id_fkey"',
+        'DROP INDEX "purchase_customer_id"',
+        'ALTER TABLE "purchase" ADD COLUMN "note" VARCHAR(255)',
+        "UPDATE purchase SET note = '50%'",
+        "-- migrator.run_python is not compiled",
+    ]
+
+    # offline the database is only used for its dialect
+    offline_db = pw.PostgresqlDatabase(None)
+    assert Router(offline_db, migrate_dir=str(tmp_path)).plan_sql(applied=["001_init"]) == expected
+    assert offline_db.is_closed()
+    assert offline_db.data_changed is False  # type: ignore[attr-defined]
+
+    router = Router(patched_pg_db, migrate_dir=str(tmp_path))
+    router.run("001_init")
+    patched_pg_db.clear_queries()
+    assert router.plan_sql() == expected
+    assert router.plan_sql(["002_purchase"]) == expected[:4]
+    # only the history is read
+    assert all(q.startswith("SELECT") for q in patched_pg_db.queries)
+    assert router.diff == ["002_purchase", "003_note"]
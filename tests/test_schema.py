@@ -2,7 +2,7 @@ import peewee as pw
 import pytest
 from playhouse.postgres_ext import ArrayField
 
-from miggy.schema import SchemaMigrator
+from miggy.schema import SchemaMigrator, coalesce_alter_table
 from miggy.utils import copy_model
 from tests.conftest import PatchedPgDatabase
 
@@ -337,3 +337,82 @@ def test___resolve_alter_check_constraints(
     schema_migrator._resolve_alter_check_constraints(old_field, new_field).run()
 
     assert patched_pg_db.queries == expected
+
+
+def test_coalesce_alter_table() -> None:
+    statements: list[tuple[str, list]] = [
+        ("ALTER TABLE `user` ADD COLUMN `age` INTEGER", []),
+        ("ALTER TABLE `user` ALTER COLUMN `name` SET DEFAULT %s", ["x"]),
+        ("ALTER TABLE `order` DROP COLUMN `age`", []),
+        ("ALTER TABLE `order` RENAME TO `orders`", []),
+        ("ALTER TABLE `orders` DROP COLUMN `a`", []),
+        ("ALTER TABLE `orders` DROP COLUMN `b` -- comment", []),
+    ]
+    assert coalesce_alter_table(statements) == [
+        ("ALTER TABLE `user` ADD COLUMN `age` INTEGER, ALTER COLUMN `name` SET DEFAULT %s", ["x"]),
+        ("ALTER TABLE `order` DROP COLUMN `age`", []),
+        ("ALTER TABLE `order` RENAME TO `orders`", []),
+        ("ALTER TABLE `orders` DROP COLUMN `a`", []),
+        ("ALTER TABLE `orders` DROP COLUMN `b` -- comment", []),
+    ]
+
+
+def test_coalesce_alter_table__same_column() -> None:
+    statements: list[tuple[str, list]] = [
+        ('ALTER TABLE "user" ADD COLUMN "age" INTEGER', []),
+        ('ALTER TABLE "user" ALTER COLUMN "age" TYPE BIGINT', []),
+        ('ALTER TABLE "user" ALTER COLUMN "name" DROP NOT NULL', []),
+        ('ALTER TABLE "user" ADD COLUMN "email" VARCHAR(255)', []),
+        ('ALTER TABLE "user" ALTER COLUMN "email" DROP NOT NULL', []),
+    ]
+    assert coalesce_alter_table(statements) == [
+        ('ALTER TABLE "user" ADD COLUMN "age" INTEGER', []),
+        (
+            'ALTER TABLE "user" ALTER COLUMN "age" TYPE BIGINT, ALTER COLUMN "name" DROP NOT NULL, '
+            'ADD COLUMN "email" VARCHAR(255)',
+            [],
+        ),
+        ('ALTER TABLE "user" ALTER COLUMN "email" DROP NOT NULL', []),
+    ]
+
+
+def test_catalog_lookups(patched_pg_db: PatchedPgDatabase) -> None:
+    class Customer(pw.Model):
+        class Meta:
+            database = patched_pg_db
+
+    class Order(pw.Model):
+        customer = pw.ForeignKeyField(Customer)
+        seller = pw.ForeignKeyField(Customer)
+
+        class Meta:
+            database = patched_pg_db
+
+    patched_pg_db.create_tables([Customer, Order])
+    patched_pg_db.clear_queries()
+    schema_migrator = SchemaMigrator.from_database(patched_pg_db)
+
+    schema_migrator.run_operations(
+        [
+            schema_migrator.drop_foreign_key_constraint("order", "customer_id"),
+            schema_migrator.drop_foreign_key_constraint("order", "seller_id"),
+            schema_migrator.drop_primary_key_constraint("order"),
+        ]
+    )
+    assert len([q for q in patched_pg_db.queries if "FROM pg_constraint" in q]) == 1
+
+    # the constraints added since the snapshot are found by reloading it
+    patched_pg_db.clear_queries()
+    schema_migrator.run_operations(
+        [
+            schema_migrator.add_foreign_key_constraint("order", "customer_id", "customer", "id"),
+            schema_migrator.drop_foreign_key_constraint("order", "customer_id"),
+            schema_migrator.add_foreign_key_constraint("order", "seller_id", "customer", "id"),
+            schema_migrator.drop_foreign_key_constraint("order", "seller_id"),
+        ]
+    )
+    assert [q for q in patched_pg_db.queries if q.startswith("ALTER TABLE") and "DROP" in q] == [
+        'ALTER TABLE "order" DROP CONSTRAINT "fk_order_customer_id_refs_customer"',
+        'ALTER TABLE "order" DROP CONSTRAINT "fk_order_seller_id_refs_customer"',
+    ]
+    assert len([q for q in patched_pg_db.queries if "FROM pg_constraint" in q]) == 2
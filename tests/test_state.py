@@ -1,5 +1,6 @@
 import peewee as pw
 
+from miggy.auto import MigrationAutodetector
 from miggy.state import State
 from miggy.utils import CheckMeta, extract_check_meta
 
@@ -176,3 +177,87 @@ def test_remove_pk_field() -> None:
 
     state.remove_field("somemodel", "id")
     assert state["somemodel"]._meta.primary_key is False
+
+
+def test_snapshot() -> None:
+    class SomeModel(pw.Model):
+        some_field = pw.CharField()
+
+    class User(pw.Model):
+        name = pw.CharField()
+
+    state = State({"user": User, "somemodel": SomeModel})
+
+    state.create_snapshot()
+    state.add_field("user", "email", pw.CharField(null=True))
+    state["user"]._meta.table_name = "users"
+    snapshot = state.pop_snapshot()
+
+    assert state["user"] is User
+    assert snapshot["somemodel"] is SomeModel
+    old_user = snapshot["user"]
+    assert old_user is not User
+    assert old_user._meta.table_name == "user"
+    assert list(old_user._meta.fields) == ["id", "name"]
+    assert old_user.name is not User.name
+    assert old_user.name.model is old_user
+
+
+def test_copy() -> None:
+    state = State()
+    state.add_model(
+        "User",
+        {
+            "age": pw.IntegerField(),
+            "email": pw.CharField(max_length=255, null=True),
+        },
+        {"table_name": "users", "schema": "tenant", "indexes": [(("email",), True)]},
+    )
+    state.add_check_constraint("User", "check_age", "age > 5")
+
+    copy = state.copy()
+
+    assert MigrationAutodetector(state, copy).changes() == []
+    assert MigrationAutodetector(copy, state).changes() == []
+    # the constraints of the copy are changed on their own
+    copy.add_check_constraint("User", "check_email", "email <> ''")
+    assert extract_check_meta(state["user"]) == [CheckMeta("check_age", "age > 5")]
+    assert [type(o).__name__ for o in MigrationAutodetector(state, copy).changes()] == ["AddCheckConstraint"]
+
+
+def test_copy_remove_fk_field() -> None:
+    class Author(pw.Model):
+        name = pw.CharField()
+
+    class Book(pw.Model):
+        author = pw.ForeignKeyField(Author)
+        editor = pw.ForeignKeyField("self", null=True)
+
+    state = State({"author": Author, "book": Book})
+    first, second = state.copy(), state.copy()
+
+    # the copies are bound to their own related models
+    for copy in (first, second):
+        assert copy["book"].author.rel_model is copy["author"] is not Author
+        assert copy["book"].author.rel_field is copy["author"].id
+        copy.remove_field("book", "author")
+        assert not hasattr(copy["author"], "book_set")
+    assert Book.author.rel_model is Author
+    assert hasattr(Author, "book_set")
+
+
+def test_copy_circular_fk_fields() -> None:
+    state = State()
+    state.add_model("Author", {"name": pw.CharField()}, {})
+    state.add_model("Book", {"author": pw.ForeignKeyField("author")}, {})
+    state.add_field("author", "best_book", pw.ForeignKeyField("book", null=True, backref="best_of"))
+
+    copy = state.copy()
+
+    Author, Book = copy["author"], copy["book"]
+    assert Author.best_book.rel_model is Book
+    assert Book.author.rel_model is Author
+    assert [f.name for f in Author._meta.sorted_fields] == ["id", "name", "best_book"]
+    assert hasattr(Book, "best_of")
+    assert hasattr(Author, "book_set")
+    assert MigrationAutodetector(state, copy).changes() == []
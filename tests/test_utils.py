@@ -1,9 +1,11 @@
 from typing import Any
+from unittest import mock
 
 import peewee as pw
 import pytest
 
-from miggy.utils import CheckMeta, DefaultMeta, copy_model, extract_check_meta, extract_default_meta
+from miggy import utils
+from miggy.utils import Check, CheckMeta, Default, DefaultMeta, copy_model, extract_check_meta, extract_default_meta
 
 
 @pytest.mark.parametrize(
@@ -107,6 +109,28 @@ def test_check_meta_from_node_unnamed() -> None:
         CheckMeta.from_node(pw.Check("price > 10"))
 
 
+def test_constraint_nodes() -> None:
+    # the same SQL as the peewee nodes
+    assert utils.node_to_string(Check("price > 0", name="check_price")) == 'CONSTRAINT "check_price" CHECK (price > 0)'
+    assert utils.node_to_string(Default("now()")) == "DEFAULT now()"
+
+    field = pw.IntegerField(constraints=[Default("0"), Check("price > 0", name="check_price")])
+    with mock.patch.object(utils, "node_to_string", wraps=utils.node_to_string) as node_to_string:
+        assert extract_default_meta(field) == DefaultMeta("0")
+        assert extract_check_meta(field) == [CheckMeta("check_price", "price > 0")]
+        assert not node_to_string.called
+
+        # the foreign nodes are parsed once
+        node = pw.Check("price > 0", name="check_price")
+        for _ in range(2):
+            assert CheckMeta.from_node(node) == CheckMeta("check_price", "price > 0")
+            assert DefaultMeta.from_node(node) is None
+        assert node_to_string.call_count == 2
+
+    with pytest.raises(ValueError, match="Unnamed CHECK constraints not supported"):
+        CheckMeta.from_node(Check("price > 10"))
+
+
 def test_copy_model() -> None:
     class User(pw.Model):
         my_pk = pw.CharField(primary_key=True)